@@ -0,0 +1,38 @@
+from random import seed
+from tempfile import TemporaryDirectory
+from git import Repo
+from gitstery.defines import SCALE_PROFILES
+from gitstery.utils import inflect_engine
+from gitstery.mystery import populate_town, preload_data
+
+# Every benchmark starts from the same seed, so each run generates the exact same mystery.
+SEED = bytes.fromhex('00112233')
+
+# Bigger profiles take too long to be benchmarked on every change.
+SCALES = ['small', 'medium', ]
+
+def skip_slow(backend_name, scale):
+    # The index backend is an order of magnitude slower, it's only benchmarked at the default size.
+    if 'index' == backend_name and 'small' != scale:
+        raise NotImplementedError()
+
+def new_town(scale):
+    # Loading the data (and `inflect`) takes longer than some of the benchmarks themselves.
+    preload_data()
+    inflect_engine()
+    seed(SEED)
+    return populate_town(SCALE_PROFILES[scale])
+
+class NewRepository():
+    """Base for benchmarks which generate into a new, empty, repository on every sample."""
+    number = 1
+    warmup_time = 0
+    timeout = 600
+
+    def setup(self, *params):
+        self.temporary_directory = TemporaryDirectory()
+        self.repo = Repo.init(self.temporary_directory.name)
+
+    def teardown(self, *params):
+        self.repo.close()
+        self.temporary_directory.cleanup()
@@ -0,0 +1,52 @@
+from collections import deque
+from itertools import islice
+from random import seed
+from gitstery.defines import DATE_START, DATE_END
+from gitstery.people import SUSPECTS
+from gitstery.mystery import preload_data
+from gitstery.fillers import random_paragraphs, random_people, random_datetimes
+from .common import SEED, SCALES, new_town
+
+class RandomParagraphs():
+    def setup(self):
+        preload_data()
+        seed(SEED)
+
+    def time_random_paragraphs(self):
+        for _ in range(1000):
+            random_paragraphs()
+
+class RandomPeople():
+    params = [1000, 100000, ]
+    param_names = ['people']
+
+    def setup(self, count):
+        preload_data()
+        seed(SEED)
+
+    def time_random_people(self, count):
+        deque(islice(random_people(SUSPECTS), count), maxlen=0)
+
+class RandomDatetimes():
+    params = [1000, 1000000, ]
+    param_names = ['datetimes']
+
+    def setup(self, count):
+        seed(SEED)
+
+    def time_random_datetimes(self, count):
+        deque(random_datetimes(count, DATE_START, DATE_END), maxlen=0)
+
+    def peakmem_random_datetimes(self, count):
+        deque(random_datetimes(count, DATE_START, DATE_END), maxlen=0)
+
+class PopulateTown():
+    params = SCALES
+    param_names = ['scale']
+    timeout = 300
+
+    def time_populate_town(self, scale):
+        new_town(scale)
+
+    def peakmem_populate_town(self, scale):
+        new_town(scale)
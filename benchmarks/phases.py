@@ -0,0 +1,61 @@
+from time import perf_counter
+from gitstery.defines import SCALE_PROFILES, BACKEND_NAMES, DRY_RUN_BACKEND
+from gitstery.mystery import build_mystery
+from .common import SCALES, skip_slow, new_town, NewRepository
+
+class BuildPhase(NewRepository):
+    """Build a single phase (after the town's commit) into a new repository.
+
+    Peak memory includes populating the town, which the phase depends on.
+    """
+    params = ([1, 2, 3, ], SCALES, list(BACKEND_NAMES))
+    param_names = ['phase', 'scale', 'backend']
+
+    def setup(self, phase, scale, backend_name):
+        # Teardown is called even for skipped benchmarks.
+        super().setup()
+        skip_slow(backend_name, scale)
+        self.town = new_town(scale)
+
+    def build(self, phase, scale, backend_name):
+        build_mystery(self.repo, self.town, backend_name, (phase, ), False,
+            scale=SCALE_PROFILES[scale])
+
+    def time_build_phase(self, *params):
+        self.build(*params)
+
+    def peakmem_build_phase(self, *params):
+        self.build(*params)
+
+    def track_commits_per_second(self, *params):
+        start = perf_counter()
+        self.build(*params)
+        seconds = perf_counter() - start
+        # The town's commit is counted as well, it's negligible next to any of the phases.
+        return int(self.repo.git.rev_list('--all', '--count')) / seconds
+
+    track_commits_per_second.unit = 'commits/s'
+
+class BuildSolution(NewRepository):
+    """Encode the solution on top of the town's commit, which is timed along with it."""
+    params = list(BACKEND_NAMES)
+    param_names = ['backend']
+
+    def setup(self, backend_name):
+        super().setup()
+        self.town = new_town('small')
+
+    def time_build_solution(self, backend_name):
+        build_mystery(self.repo, self.town, backend_name, (), True)
+
+class DryRun():
+    """Record a whole mystery with the dry-run backend, which doesn't write anything."""
+    params = SCALES
+    param_names = ['scale']
+    timeout = 600
+
+    def setup(self, scale):
+        self.town = new_town(scale)
+
+    def time_dry_run(self, scale):
+        build_mystery(None, self.town, DRY_RUN_BACKEND, scale=SCALE_PROFILES[scale])
@@ -0,0 +1,23 @@
+import sys
+from subprocess import check_output
+
+# Importing any of these takes longer than everything else the CLI does on startup, so they're only
+# imported by the commands using them.
+HEAVY_MODULES = ('git', 'inflect', 'gitstery.mystery', )
+
+class Startup():
+    """Every command, `verify` included, pays for importing the CLI."""
+    def timeraw_import_cli(self):
+        return 'import gitstery.cli'
+
+    def track_imported_modules(self):
+        # Fails (rather than just regresses) once any of the heavy modules is imported on startup.
+        modules = check_output(
+            [sys.executable, '-c', 'import sys, gitstery.cli; print(*sys.modules)'],
+            universal_newlines=True).split()
+        imported = [module for module in HEAVY_MODULES if module in modules]
+        if imported:
+            raise AssertionError(f'Importing the CLI imports {", ".join(imported)}')
+        return len(modules)
+
+    track_imported_modules.unit = 'modules'
@@ -0,0 +1,29 @@
+from pathlib import Path
+from git import Repo
+from gitstery.defines import SCALE_PROFILES
+from gitstery.mystery import build_mystery
+from gitstery.solution import verify_repository
+from .common import SCALES, new_town
+
+class VerifyRepository():
+    params = SCALES
+    param_names = ['scale']
+    timeout = 600
+
+    def setup_cache(self):
+        # Generated once for all of the samples, in the benchmarks' (temporary) working directory.
+        repo_dirs = {}
+        for scale in SCALES:
+            repo = Repo.init(Path(scale), mkdir=True)
+            build_mystery(repo, new_town(scale), 'fast-import', scale=SCALE_PROFILES[scale])
+            repo_dirs[scale] = repo.working_tree_dir
+        return repo_dirs
+
+    def setup(self, repo_dirs, scale):
+        self.repo = Repo(repo_dirs[scale])
+
+    def teardown(self, repo_dirs, scale):
+        self.repo.close()
+
+    def time_verify_repository(self, repo_dirs, scale):
+        assert verify_repository(self.repo)
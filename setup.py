@@ -1,5 +1,7 @@
+import sys
 from pathlib import Path
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 SRC_DIR = Path('src/gitstery')
 DATA_DIR = SRC_DIR / 'data'
@@ -8,6 +10,19 @@ DATA_FILES = [
     for p in DATA_DIR.glob('**/*')
     if p.is_file()]
 
+class BuildPyWithBookIndex(build_py):
+    """Pre-build the index of the book's paragraphs, so it isn't parsed every time it's loaded."""
+    def run(self):
+        super().run()
+        if self.dry_run:
+            return
+        sys.path.insert(0, self.build_lib)
+        try:
+            from gitstery.book import write_index
+            write_index(Path(self.build_lib) / 'gitstery' / 'data' / 'book.idx')
+        finally:
+            sys.path.remove(self.build_lib)
+
 CONSOLE_SCRIPTS = {
     'gitstery': 'gitstery.cli:cli',
 }
@@ -29,6 +44,12 @@ setup(
         'gitstery': DATA_FILES,
     },
     install_requires=Path('requirements.txt').read_text().splitlines(),
+    extras_require={
+        'dev': ['pyflakes', 'pytest', ],
+    },
+    cmdclass={
+        'build_py': BuildPyWithBookIndex,
+    },
     entry_points={
         'console_scripts': [f'{name}={path}' for (name, path) in CONSOLE_SCRIPTS.items()],
     },
@@ -0,0 +1,317 @@
+import json
+from os import SEEK_END
+from itertools import count
+from contextlib import contextmanager
+from subprocess import PIPE
+from tempfile import TemporaryFile
+from git import Blob
+from .defines import BACKEND_NAMES, DRY_RUN_BACKEND
+from .git_utils import (git_commit, restore_head, commit_message, git_date, blob_hash,
+    store_object, object_hash, tree_hash, commit_object)
+
+class IndexBackend():
+    """Build the mystery through the repository's index.
+
+    Every commit is written by GitPython's `IndexFile.commit`. Files are only written to the working
+    tree once the mystery is done.
+    """
+    supports_bare = False
+
+    def __init__(self, repo):
+        self.__repo = repo
+
+    @property
+    def repo(self):
+        return self.__repo
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.__repo.head.reset(index=True, working_tree=True)
+
+    def blob(self, text):
+        # Write the object straight into the object database, spawning `git hash-object` for every
+        # blob makes generation scale with the number of processes rather than with the content.
+        return store_object(self.__repo.odb, Blob.type, text.encode())
+
+    def commit(self, author, date, title, body='', files=None, blobs=None):
+        # Files are written straight to the object database and the index, so growing files don't
+        # have to be rewritten to the working tree (and read back) for every commit.
+        entries = dict((path, self.blob(text)) for (path, text) in (files or {}).items())
+        entries.update(blobs or {})
+        if entries:
+            self.__repo.index.add([
+                Blob(self.__repo, bytes.fromhex(hexsha), mode=Blob.file_mode, path=path)
+                for (path, hexsha) in entries.items()])
+        git_commit(self.__repo, author, date, title, body)
+
+    def checkpoint(self):
+        return self.__repo.head.commit.hexsha
+
+    def tag(self, name, ref='HEAD'):
+        self.__repo.create_tag(name, ref=ref)
+
+    @contextmanager
+    def branch(self, name):
+        with restore_head(self.__repo):
+            self.__repo.create_head(name).checkout()
+            yield
+
+    @contextmanager
+    def detached(self):
+        with restore_head(self.__repo):
+            self.__repo.head.reference = self.__repo.commit('HEAD')
+            assert self.__repo.head.is_detached
+            yield
+
+    @contextmanager
+    def orphan(self, name):
+        with restore_head(self.__repo):
+            self.__repo.git.checkout('--orphan', name)
+            self.__repo.index.remove('*', force=True, working_tree=True)
+            yield
+
+class FastImportBackend():
+    """Stream the whole mystery into a single `git fast-import` process.
+
+    Commits are written to their references directly, without going through the index or the
+    working tree. Only once the import is done is the current branch checked out (unless the
+    repository is bare).
+    """
+    supports_bare = True
+
+    # Commits made with a detached head still need a reference to be written to, this one is
+    # deleted once the import is done.
+    DETACHED_REF = 'refs/gitstery/detached'
+
+    def __init__(self, repo):
+        self.__repo = repo
+        self.__process = None
+        self.__marks = count(1)
+        self.__blobs = {}
+        self.__late_tags = {}
+        self.__ref = repo.head.ref.path
+        # The head is what `from` commands are given, a mark or (when resuming a generation on top
+        # of commits already in the repository) an object ID.
+        self.__head = repo.head.commit.hexsha if repo.head.is_valid() else None
+
+    @property
+    def repo(self):
+        return self.__repo
+
+    def __enter__(self):
+        self.__process = self.__repo.git.fast_import('--done', '--quiet',
+            as_process=True, istream=PIPE)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Don't let a partial import update any of the references.
+            self.__process.proc.kill()
+            self.__process.proc.wait()
+            return
+
+        self.__write('done\n')
+        self.__process.stdin.close()
+        self.__process.wait()
+
+        # A checkpoint could have written the detached head's reference.
+        self.__repo.git.update_ref('-d', self.DETACHED_REF)
+
+        self.__create_late_tags()
+        if not self.__repo.bare:
+            self.__repo.head.reset(index=True, working_tree=True)
+
+    def blob(self, text):
+        data = text.encode()
+        hexsha = blob_hash(data)
+        if hexsha not in self.__blobs:
+            self.__blobs[hexsha] = next(self.__marks)
+            self.__write(f'blob\nmark :{self.__blobs[hexsha]}\n')
+            self.__write_data(data)
+        return hexsha
+
+    def commit(self, author, date, title, body='', files=None, blobs=None):
+        entries = dict((path, self.blob(text)) for (path, text) in (files or {}).items())
+        entries.update(blobs or {})
+
+        mark = next(self.__marks)
+        self.__write(f'commit {self.__ref}\nmark :{mark}\n')
+        self.__write(f'author {author.name} <{author.email}> {git_date(date)}\n')
+        self.__write(f'committer {author.name} <{author.email}> {git_date(date)}\n')
+        self.__write_data(commit_message(title, body).encode())
+        if self.__head is not None:
+            self.__write(f'from {self.__head}\n')
+        for (path, hexsha) in entries.items():
+            self.__write(f'M 100644 {self.__dataref(hexsha)} {path}\n')
+        self.__write('\n')
+        self.__head = f':{mark}'
+
+    def checkpoint(self):
+        # Flush everything imported so far into the object database and references, so others can
+        # read it or build on top of it. `get-mark` (or `progress`, if nothing was committed yet)
+        # is only answered once the checkpoint is done.
+        self.__write('checkpoint\n')
+        if self.__head.startswith(':'):
+            self.__write(f'get-mark {self.__head}\n')
+        else:
+            self.__write('progress checkpoint\n')
+        self.__process.stdin.flush()
+        response = self.__process.stdout.readline().decode().strip()
+
+        # Everything the late tags point at was written as well.
+        self.__create_late_tags()
+        return response if self.__head.startswith(':') else self.__head
+
+    def tag(self, name, ref=None):
+        if ref is None:
+            self.__write(f'reset refs/tags/{name}\nfrom {self.__head}\n\n')
+        else:
+            # `fast-import` can only point references at commits, so tags to arbitrary objects are
+            # created once they're written (at the next checkpoint, or once the import is done).
+            self.__late_tags[name] = ref
+
+    @contextmanager
+    def branch(self, name):
+        with self.__switch(f'refs/heads/{name}', self.__head):
+            self.__write(f'reset {self.__ref}\nfrom {self.__head}\n\n')
+            yield
+
+    @contextmanager
+    def detached(self):
+        with self.__switch(self.DETACHED_REF, self.__head):
+            yield
+
+    @contextmanager
+    def orphan(self, name):
+        with self.__switch(f'refs/heads/{name}', None):
+            yield
+
+    @contextmanager
+    def __switch(self, ref, head):
+        prev = (self.__ref, self.__head)
+        (self.__ref, self.__head) = (ref, head)
+        try:
+            yield
+        finally:
+            (self.__ref, self.__head) = prev
+
+    def __create_late_tags(self):
+        for (name, ref) in self.__late_tags.items():
+            self.__repo.create_tag(name, ref=ref)
+        self.__late_tags.clear()
+
+    def __dataref(self, hexsha):
+        return f':{self.__blobs[hexsha]}' if hexsha in self.__blobs else hexsha
+
+    def __write(self, command):
+        self.__process.stdin.write(command.encode())
+
+    def __write_data(self, data):
+        self.__write(f'data {len(data)}\n')
+        self.__process.stdin.write(data)
+        self.__write('\n')
+
+class DryRunBackend():
+    """Record the mystery's commits and references without writing anything.
+
+    Objects' IDs are computed the same way git computes them, so the recorded references are the
+    ones a real run from the same seed ends up with. There's no repository, and the commits made
+    with a detached head aren't recorded under any reference. The commits are recorded to a
+    temporary file as they're made, so there's no need to hold all of them.
+    """
+    supports_bare = True
+
+    def __init__(self, repo=None):
+        self.__ref = 'refs/heads/master'
+        self.__head = None
+        self.__files = {}
+        self.__refs = {}
+        self.__commits = TemporaryFile('w+')
+        self.__commits_count = 0
+
+    @property
+    def repo(self):
+        return None
+
+    @property
+    def refs(self):
+        return dict(sorted(self.__refs.items()))
+
+    @property
+    def commits(self):
+        """Generate the commits recorded so far, in the order they were made."""
+        self.__commits.seek(0)
+        for line in self.__commits:
+            yield json.loads(line)
+
+    @property
+    def commits_count(self):
+        return self.__commits_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def blob(self, text):
+        return blob_hash(text)
+
+    def commit(self, author, date, title, body='', files=None, blobs=None):
+        entries = dict((path, self.blob(text)) for (path, text) in (files or {}).items())
+        entries.update(blobs or {})
+        self.__files = dict(self.__files, **entries)
+
+        parents = [self.__head, ] if self.__head else []
+        self.__head = object_hash('commit', commit_object(
+            tree_hash(self.__files), parents, author, date, commit_message(title, body)))
+        if self.__ref:
+            self.__refs[self.__ref] = self.__head
+        self.__commits.seek(0, SEEK_END)
+        self.__commits.write(json.dumps({
+            'commit': self.__head,
+            'ref': self.__ref,
+            'author': author.name,
+            'date': date.isoformat(),
+            'title': title,
+            'files': entries,
+        }) + '\n')
+        self.__commits_count += 1
+
+    def checkpoint(self):
+        return self.__head
+
+    def tag(self, name, ref=None):
+        self.__refs[f'refs/tags/{name}'] = self.__head if ref in (None, 'HEAD') else ref
+
+    @contextmanager
+    def branch(self, name):
+        with self.__switch(f'refs/heads/{name}', self.__head, self.__files):
+            if self.__head:
+                self.__refs[self.__ref] = self.__head
+            yield
+
+    @contextmanager
+    def detached(self):
+        with self.__switch(None, self.__head, self.__files):
+            yield
+
+    @contextmanager
+    def orphan(self, name):
+        with self.__switch(f'refs/heads/{name}', None, {}):
+            yield
+
+    @contextmanager
+    def __switch(self, ref, head, files):
+        prev = (self.__ref, self.__head, self.__files)
+        (self.__ref, self.__head, self.__files) = (ref, head, files)
+        try:
+            yield
+        finally:
+            (self.__ref, self.__head, self.__files) = prev
+
+BACKENDS = dict(zip(BACKEND_NAMES, (IndexBackend, FastImportBackend)))
+BACKENDS[DRY_RUN_BACKEND] = DryRunBackend
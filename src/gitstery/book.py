@@ -0,0 +1,95 @@
+import sys
+from mmap import mmap, ACCESS_READ
+from array import array
+from struct import Struct
+from hashlib import sha1
+from itertools import islice
+from textwrap import dedent
+from .defines import DATA_DIR, COMMIT_MSG_WIDTH
+from .utils import WrappedText, wrap_paragraphs
+
+BOOK_PATH = DATA_DIR / 'book.txt'
+# Generated when the package is built (see `setup.py`), the book is parsed on load if it's missing.
+INDEX_PATH = DATA_DIR / 'book.idx'
+
+# The index holds the book's paragraphs, already wrapped and separated by empty lines, preceded by
+# the offset of each paragraph. A header identifies the book and width the index was built for.
+INDEX_MAGIC = b'GTPI'
+INDEX_HEADER = Struct('<4sH20sI')
+PARAGRAPHS_SEPARATOR = '\n\n'
+
+def parse_paragraphs(book_text):
+    # Split the book by paragraphs, we drop the first 50 "paragraphs" to skip the title, TOC, and
+    # parts of the exposition. We also drop "empty" paragraph, stories and chapter titles.
+    paragraphs = (' '.join(dedent(p).splitlines()) for p in book_text.split('\n\n'))
+    return [p for p in islice(paragraphs, 50, None)
+        if p and not (p.startswith(' ') or p.startswith('CHAPTER'))]
+
+def write_index(index_path=INDEX_PATH, book_path=BOOK_PATH, width=COMMIT_MSG_WIDTH):
+    book = book_path.read_bytes()
+    paragraphs = [wrap_paragraphs(p, width).encode()
+        for p in parse_paragraphs(book.decode())]
+
+    offsets = array('I', [0, ])
+    for paragraph in paragraphs:
+        offsets.append(offsets[-1] + len(paragraph) + len(PARAGRAPHS_SEPARATOR))
+    if 'little' != sys.byteorder:
+        offsets.byteswap()
+
+    with index_path.open('wb') as index:
+        index.write(INDEX_HEADER.pack(INDEX_MAGIC, width, sha1(book).digest(), len(paragraphs)))
+        index.write(offsets.tobytes())
+        index.write(PARAGRAPHS_SEPARATOR.encode().join(paragraphs))
+        index.write(PARAGRAPHS_SEPARATOR.encode())
+
+class Paragraphs():
+    """The book's paragraphs, wrapped to the commit message width.
+
+    Any run of consecutive paragraphs is a single slice of the underlying text, which is memory-mapped
+    from the pre-built index when there's a valid one.
+    """
+    def __init__(self, text, offsets):
+        self.__text = text
+        self.__offsets = offsets
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+    def join(self, index, count=1):
+        stop = min(index + count, len(self))
+        text = self.__text[self.__offsets[index]:self.__offsets[stop] - len(PARAGRAPHS_SEPARATOR)]
+        return WrappedText(text if isinstance(text, str) else str(text, 'utf-8'))
+
+    @classmethod
+    def load(cls):
+        try:
+            return cls.from_index()
+        except (OSError, ValueError):
+            return cls.from_book()
+
+    @classmethod
+    def from_index(cls, index_path=INDEX_PATH, book_path=BOOK_PATH):
+        with index_path.open('rb') as index:
+            data = mmap(index.fileno(), 0, access=ACCESS_READ)
+        (magic, width, book_digest, count) = INDEX_HEADER.unpack_from(data)
+        if (INDEX_MAGIC, COMMIT_MSG_WIDTH) != (magic, width):
+            raise ValueError(f'{index_path} is not an index for the current width')
+        if sha1(book_path.read_bytes()).digest() != book_digest:
+            raise ValueError(f'{index_path} is out of date')
+
+        offsets = array('I')
+        offsets_end = INDEX_HEADER.size + (count + 1) * offsets.itemsize
+        if 'little' == sys.byteorder:
+            offsets = memoryview(data)[INDEX_HEADER.size:offsets_end].cast('I')
+        else:
+            offsets.frombytes(data[INDEX_HEADER.size:offsets_end])
+            offsets.byteswap()
+        return cls(memoryview(data)[offsets_end:], offsets)
+
+    @classmethod
+    def from_book(cls, book_path=BOOK_PATH):
+        paragraphs = [wrap_paragraphs(p) for p in parse_paragraphs(book_path.read_bytes().decode())]
+        offsets = [0, ]
+        for paragraph in paragraphs:
+            offsets.append(offsets[-1] + len(paragraph) + len(PARAGRAPHS_SEPARATOR))
+        return cls(PARAGRAPHS_SEPARATOR.join(paragraphs) + PARAGRAPHS_SEPARATOR, offsets)
@@ -0,0 +1,139 @@
+import json
+import random
+from os import utime
+from itertools import chain
+from contextlib import contextmanager
+from pathlib import Path
+from hashlib import sha1
+from shutil import rmtree, copyfile
+from tempfile import mkdtemp
+from .defines import PACKAGE_DIR
+from .git_utils import git_stdin
+
+# Cached references are written back as-is, these are the backends' internal references.
+INTERNAL_REFS = 'refs/gitstery/'
+
+def package_digest():
+    """Digest the package's sources and data files, cached objects are only valid for those."""
+    digest = sha1()
+    for path in sorted(PACKAGE_DIR.glob('**/*')):
+        if path.is_file() and '__pycache__' not in path.parts:
+            digest.update(path.relative_to(PACKAGE_DIR).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+class ObjectCache():
+    """An on-disk cache of the objects and references generated by each phase.
+
+    A phase's output depends only on the commit it's built on top of, the state of the random
+    generator when it starts, the town's residents, the mystery's scale and the package itself, so
+    those make up the key. Each entry holds a pack of the objects the phase wrote, the references it
+    created and the random generator's state after it's done. The least recently used entries are
+    evicted once the cache grows beyond its maximal size.
+    """
+    def __init__(self, cache_dir, max_size):
+        # Objects are packed into it by git, running in the repository.
+        self.__cache_dir = Path(cache_dir).resolve()
+        self.__cache_dir.mkdir(parents=True, exist_ok=True)
+        self.__max_size = max_size
+        self.__package_digest = package_digest()
+
+    def key(self, phase, base, town, scale):
+        digest = sha1()
+        digest.update(self.__package_digest.encode())
+        digest.update(f'{phase}\0{base}\0{tuple(scale)}\0'.encode())
+        digest.update(repr(random.getstate()).encode())
+        for street_name in town:
+            names = (town.name(resident) for resident in town.street(street_name))
+            digest.update(street_name.encode())
+            digest.update('\0'.join(names).encode())
+        return digest.hexdigest()
+
+    @contextmanager
+    def phase(self, phase, backend, town, scale):
+        """Restore a phase from the cache if possible, otherwise cache it once it's generated.
+
+        Yields whether the phase was restored (and so shouldn't be generated).
+        """
+        base = backend.checkpoint()
+        key = self.key(phase, base, town, scale)
+        if self.restore(key, backend.repo):
+            yield True
+            return
+
+        refs_before = _refs(backend.repo)
+        yield False
+        backend.checkpoint()
+        self.store(key, backend.repo, base, refs_before)
+
+    def restore(self, key, repo):
+        """Import a cached phase into the repository, returning whether there was one to import."""
+        entry_dir = self.__cache_dir / key
+        try:
+            entry = json.loads(entry_dir.joinpath('entry.json').read_text())
+        except (OSError, ValueError):
+            return False
+
+        pack_dir = Path(repo.git_dir) / 'objects' / 'pack'
+        pack_dir.mkdir(parents=True, exist_ok=True)
+        for extension in ('pack', 'idx'):
+            copyfile(entry_dir / f'objects.{extension}',
+                pack_dir / f'pack-{entry["pack"]}.{extension}')
+        git_stdin(repo, ['update-ref', '--stdin'],
+            (f'update {ref} {hexsha}' for (ref, hexsha) in entry['refs'].items()))
+
+        (version, state, gauss_next) = entry['random_state']
+        random.setstate((version, tuple(state), gauss_next))
+
+        # Mark the entry as recently used.
+        utime(entry_dir)
+        return True
+
+    def store(self, key, repo, base, refs_before):
+        """Cache the objects and references a phase added on top of the `base` commit.
+
+        All of the phase's objects must already be in the repository's object database.
+        """
+        refs = dict(
+            (ref, hexsha) for (ref, hexsha) in _refs(repo).items()
+            if refs_before.get(ref) != hexsha and not ref.startswith(INTERNAL_REFS))
+        if not refs:
+            return
+
+        # Build the entry aside and move it into place, so a concurrent run never sees it partially
+        # written.
+        entry_dir = Path(mkdtemp(dir=self.__cache_dir, prefix='.'))
+        try:
+            pack = git_stdin(repo, ['pack-objects', '--revs', '-q', str(entry_dir / 'objects')],
+                chain(refs.values(), [f'^{base}']))
+            for extension in ('pack', 'idx'):
+                entry_dir.joinpath(f'objects-{pack}.{extension}').rename(
+                    entry_dir / f'objects.{extension}')
+            entry_dir.joinpath('entry.json').write_text(json.dumps({
+                'pack': pack,
+                'refs': refs,
+                'random_state': random.getstate(),
+            }))
+            entry_dir.rename(self.__cache_dir / key)
+        except OSError:
+            # Another run cached the same entry first.
+            rmtree(entry_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        entries = sorted(
+            (entry_dir for entry_dir in self.__cache_dir.iterdir()
+                if entry_dir.is_dir() and not entry_dir.name.startswith('.')),
+            key=lambda entry_dir: entry_dir.stat().st_mtime,
+            reverse=True)
+        total_size = 0
+        for entry_dir in entries:
+            total_size += sum(path.stat().st_size for path in entry_dir.iterdir())
+            if self.__max_size < total_size:
+                rmtree(entry_dir, ignore_errors=True)
+
+def _refs(repo):
+    return dict(line.split(' ', 1)[::-1]
+        for line in repo.git.for_each_ref('--format=%(objectname) %(refname)').splitlines())
@@ -0,0 +1,76 @@
+import json
+import random
+from pathlib import Path
+from .git_utils import git_stdin, local_refs
+
+class Checkpoint():
+    """A record of a generation's progress, from which it can be resumed if it's interrupted.
+
+    It's kept in the repository's git directory, holding the generation's details (its seed, scale,
+    phases and whether it has a solution), the steps done so far and the references and the random
+    generator's state after the last of them.
+    """
+    FILE_NAME = 'gitstery-checkpoint.json'
+
+    def __init__(self, repo, details, done=(), refs=None, head=None, random_state=None):
+        self.__repo = repo
+        self.__path = Path(repo.git_dir) / self.FILE_NAME
+        self.__details = details
+        self.__done = list(done)
+        self.__refs = refs or {}
+        self.__head = head
+        self.__random_state = random_state
+
+    @classmethod
+    def load(cls, repo):
+        """Load the repository's checkpoint, raising an `OSError` or `ValueError` if it has none."""
+        checkpoint = json.loads((Path(repo.git_dir) / cls.FILE_NAME).read_text())
+        return cls(repo, checkpoint['details'], checkpoint['done'], checkpoint['refs'],
+            checkpoint['head'], checkpoint['random_state'])
+
+    @property
+    def details(self):
+        return self.__details
+
+    @property
+    def done(self):
+        return tuple(self.__done)
+
+    def record(self, step, backend):
+        """Record a step as done, once everything it wrote is in the repository."""
+        backend.checkpoint()
+        self.__done.append(step)
+        self.__refs = local_refs(self.__repo)
+        self.__head = self.__repo.head.ref.path
+        self.__random_state = random.getstate()
+
+        # Written aside and moved into place, so an interrupted run never leaves it half written.
+        temporary_path = self.__path.with_suffix('.tmp')
+        temporary_path.write_text(json.dumps({
+            'details': self.__details,
+            'done': self.__done,
+            'refs': self.__refs,
+            'head': self.__head,
+            'random_state': self.__random_state,
+        }))
+        temporary_path.replace(self.__path)
+
+    def restore(self):
+        """Bring the repository and the random generator back to their state after the last step.
+
+        Anything an interrupted step wrote is dropped, its objects are left for git to collect.
+        """
+        current_refs = local_refs(self.__repo)
+        git_stdin(self.__repo, ['update-ref', '--stdin'], [
+            *(f'update {ref} {hexsha}' for (ref, hexsha) in self.__refs.items()),
+            *(f'delete {ref}' for ref in current_refs if ref not in self.__refs),
+        ])
+        self.__repo.git.symbolic_ref('HEAD', self.__head)
+        if not self.__repo.bare:
+            self.__repo.head.reset(index=True, working_tree=True)
+
+        (version, state, gauss_next) = self.__random_state
+        random.setstate((version, tuple(state), gauss_next))
+
+    def remove(self):
+        self.__path.unlink(missing_ok=True)
@@ -1,31 +1,88 @@
 import sys
-from os import environ, urandom
+import json
+from os import environ, urandom, cpu_count, devnull
 from urllib.parse import urlparse
-from itertools import chain
 from pathlib import Path
-from contextlib import contextmanager, nullcontext
-from datetime import timedelta
-from random import seed, choice, choices, randrange
+from io import StringIO
+from contextlib import contextmanager, redirect_stdout
+from random import seed
 from shutil import rmtree
 from tempfile import TemporaryDirectory
-from csv import DictWriter
-from inflect import engine
-from click import (Path as ClickPath, group, pass_context, argument, option, prompt, confirm, echo,
-    secho, IntRange)
-from git import Repo
-from .defines import DATA_DIR, DATE_START, DATE_REPORT_WEEK_START, POLICE_BRANCH
-from .people import MAYOR, MAIN_DETECTIVE, OTHER_DETECTIVES, SUSPECTS, FACTORY_WORKERS
-from .fillers import random_people
-from .git_utils import git_commit
-from .phases import PHASES_COUNT, build_phase_1, build_phase_2, build_phase_3
-from .solution import build_solution, verify_repository
+from time import perf_counter
+from click import (Path as ClickPath, File, ParamType, group, pass_context, argument, option, prompt,
+    confirm, echo, secho, IntRange, Choice, UsageError)
+from .defines import (PHASES_COUNT, BACKEND_NAMES, DRY_RUN_BACKEND, BUNDLE_DELTA_WINDOW,
+    BUNDLE_DELTA_DEPTH, SERVED_MAX_AGE_MINUTES, SERVED_MAX_COUNT, Scale, SCALE_PROFILES)
+
+# Most of the commands' dependencies (GitPython, `inflect` and the phases) are only imported by the
+# commands using them. Some commands (like `verify`) are called often enough for the interpreter's
+# startup time to matter.
+
+class RepositoryType(ParamType):
+    name = 'repository'
+
+    def convert(self, value, param, ctx):
+        from git import Repo, InvalidGitRepositoryError, NoSuchPathError
+        if isinstance(value, Repo):
+            return value
+        try:
+            return Repo(value)
+        except (InvalidGitRepositoryError, NoSuchPathError):
+            self.fail(f'{value}: Not a git repository', param, ctx)
+
+class ScaleType(ParamType):
+    name = 'scale'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, Scale):
+            return value
+        if value in SCALE_PROFILES:
+            return SCALE_PROFILES[value]
+        try:
+            factor = int(value)
+        except ValueError:
+            factor = 0
+        if factor < 1:
+            profiles = ', '.join(SCALE_PROFILES)
+            self.fail(f'{value}: Neither a profile ({profiles}) nor a positive number', param, ctx)
+        return Scale(factor, factor, factor)
 
 @contextmanager
-def clone_repository(url):
+def fetch_repository(url):
+    """Fetch only what's needed to verify the mystery at URL into a temporary bare repository.
+
+    The `master` and main detective's branches (whose files are searched) are fetched whole, the
+    rest of the branches and tags are fetched without their blobs. Git fetches the few blobs read
+    from those lazily, if the remote supports it (otherwise they're all fetched to begin with).
+    """
+    from git import Repo
+    from .defines import POLICE_BRANCH
+    from .people import MAIN_DETECTIVE
+
+    def _refspecs(*refs):
+        return [f'+{ref}:{ref}' for ref in refs]
+
     with TemporaryDirectory() as temporary_directory:
-        echo(f'Cloning {url} to {temporary_directory}')
-        cloned = Repo.clone_from(url, temporary_directory)
-        yield cloned
+        echo(f'Fetching {url} to {temporary_directory}')
+        repo = Repo.init(temporary_directory, bare=True)
+        with repo.config_writer() as config:
+            config.set_value('remote "origin"', 'url', url)
+        repo.git.fetch('--no-tags', 'origin', *_refspecs(
+            'refs/heads/master',
+            f'refs/heads/detectives/{MAIN_DETECTIVE.username}'))
+
+        with repo.config_writer() as config:
+            config.set_value('remote "origin"', 'promisor', 'true')
+            config.set_value('remote "origin"', 'partialclonefilter', 'blob:none')
+            config.set_value('extensions', 'partialClone', 'origin')
+        repo.git.fetch('--no-tags', '--filter=blob:none', 'origin', *_refspecs(
+            f'refs/heads/{POLICE_BRANCH}',
+            'refs/heads/investigations',
+            'refs/tags/street/*',
+            'refs/tags/solution'))
+
+        repo.git.symbolic_ref('HEAD', 'refs/heads/master')
+        yield repo
 
 @group()
 def cli():
@@ -37,7 +94,8 @@ def cli():
             del environ[env_var]
 
 @cli.command()
-@argument('repo_dir', type=ClickPath(file_okay=False, writable=True), envvar='GITSTERY_TEMP_DIR')
+@argument('repo_dir', type=ClickPath(file_okay=False, writable=True), envvar='GITSTERY_TEMP_DIR',
+    required=False)
 @option('--force', '-f', is_flag=True, help='Override directory even if exists.')
 @option('--seed', '-s', 'seed_value', type=bytes.fromhex, metavar='SEED', envvar='GITSTERY_SEED',
     help='Set random seed for reproducible runs.')
@@ -45,175 +103,543 @@ def cli():
         metavar='INDEX', multiple=True, help='Generate only selected phases.')
 @option('--no-phases', '-P', is_flag=True, show_default=True, help="Don't generate any phases.")
 @option('--no-solution', '-S', is_flag=True, show_default=True, help="Don't generate solution.")
+@option('--backend', 'backend_name', type=Choice(BACKEND_NAMES),
+    show_default='index, or fast-import with --bare',
+    help='How to write the repository\'s objects and references.')
+@option('--bare', is_flag=True, help='Create a bare repository, without checking out any branch.')
+@option('--jobs', '-j', type=IntRange(1), default=1, show_default=True,
+    help='Number of processes to write the streets with.')
+@option('--scale', type=ScaleType(), default='small', show_default=True, metavar='PROFILE|N',
+    help='Make the mystery bigger, by a named profile or by multiplying all of its sizes.')
+@option('--cache-dir', type=ClickPath(file_okay=False, writable=True), envvar='GITSTERY_CACHE_DIR',
+    help='Cache the generated phases in this directory, and reuse them when possible.')
+@option('--cache-size', type=IntRange(0), default=1024, show_default=True, metavar='MB',
+    help='Maximal size of the cache.')
+@option('--bundle', 'bundle_path', type=ClickPath(dir_okay=False, writable=True),
+    help='Also export the mystery as a single bundle file.')
+@option('--profile-report', 'report_path', type=ClickPath(dir_okay=False, writable=True),
+    help='Write a JSON report of the time and resources each phase took.')
+@option('--profile-dir', type=ClickPath(file_okay=False, writable=True),
+    help='Write a cProfile dump of each phase to this directory.')
 @option('--push', 'push_remote', is_flag=True, show_default=True, help='Push to target repository.')
 @option('--target-repository', '--target-repo', '--target', '-t', 'remote_url', metavar='URL',
     envvar='GITSTERY_TARGET_REPO', help='Target repository.')
+@option('--dry-run', is_flag=True,
+    help='Make all of the mystery\'s random decisions without writing any repository.')
+@option('--manifest', 'manifest_file', type=File('w'), metavar='PATH',
+    help='Write what a dry run decided as JSON (`-` for the standard output).')
+@option('--resume', is_flag=True,
+    help='Resume an interrupted generation in REPO_DIR from its last completed phase.')
+@option('--shared-store', 'store_dir', type=ClickPath(file_okay=False, writable=True),
+    envvar='GITSTERY_SHARED_STORE',
+    help='Keep the objects mysteries share in this object store, linked as an alternate.')
 @pass_context
-def generate(ctx, repo_dir, force, seed_value, chosen_phases, no_phases, no_solution, push_remote,
-        remote_url):
-    """Generate a git repository of a Git Murder Mystery."""
+def generate(ctx, repo_dir, force, seed_value, chosen_phases, no_phases, no_solution, backend_name,
+        bare, jobs, scale, cache_dir, cache_size, bundle_path, report_path, profile_dir, push_remote,
+        remote_url, dry_run, manifest_file, resume, store_dir):
+    """Generate a git repository of a Git Murder Mystery.
+
+    With `--dry-run` nothing is written (so there's no need for REPO_DIR), the mystery's commits and
+    references are only recorded. They're the same as a real run's, given the same seed.
+
+    A checkpoint is recorded after the setup and after each phase. With `--resume`, an interrupted
+    generation continues from its last checkpoint, with the seed, scale and phases it was started
+    with (and unless given another, its backend), and ends up the same as if it was never
+    interrupted.
+
+    With `--shared-store` the mystery's blobs are moved into a store shared by many mysteries, and
+    the repository only keeps the rest of its objects. See the `detach` command.
+    """
+    from git import Repo, InvalidGitRepositoryError, NoSuchPathError
+    from .backends import BACKENDS
+    from .cache import ObjectCache
+    from .checkpoint import Checkpoint
+    from .mystery import populate_town, build_mystery, write_manifest
+    from .profiling import ProfileReport, profile_step
+    from .store import SharedStore
+
+    if dry_run and resume:
+        raise UsageError('--resume can\'t be used with --dry-run')
+    if dry_run:
+        conflicting = [name for (name, value) in (
+            ('--bundle', bundle_path),
+            ('--push', push_remote),
+            ('--cache-dir', cache_dir),
+            ('--shared-store', store_dir),
+            ('--profile-report', report_path),
+            ('--profile-dir', profile_dir)) if value]
+        if conflicting:
+            raise UsageError(f'{", ".join(conflicting)} can\'t be used with --dry-run')
+    elif manifest_file:
+        raise UsageError('--manifest can only be used with --dry-run')
+    elif not repo_dir:
+        raise UsageError('Missing argument \'REPO_DIR\'')
+
+    checkpoint = None
+    if resume:
+        try:
+            repo = Repo(repo_dir)
+            checkpoint = Checkpoint.load(repo)
+        except (InvalidGitRepositoryError, NoSuchPathError, OSError, ValueError):
+            raise UsageError(f'There\'s no interrupted generation to resume in {repo_dir}')
+        details = checkpoint.details
+        seed_value = bytes.fromhex(details['seed'])
+        scale = Scale(**details['scale'])
+        (chosen_phases, no_solution) = (details['phases'], not details['solution'])
+        bare = repo.bare
+        backend_name = backend_name or details['backend']
+        store_dir = details.get('shared_store')
+        secho(f'Resuming after {", ".join(map(str, checkpoint.done))}', fg='magenta')
+
+    backend_name = backend_name or ('fast-import' if bare else 'index')
+    if bare and not BACKENDS[backend_name].supports_bare:
+        raise UsageError(f'The {backend_name} backend requires a working tree')
+
     seed_value = seed_value if seed_value else urandom(10)
-    echo(f'Using seed {seed_value.hex()}')
+    # A dry run's progress is reported to the standard error, so its manifest could be written to
+    # the standard output.
+    echo(f'Using seed {seed_value.hex()}', err=dry_run)
     seed(seed_value)
 
-    everyone = list(sorted(chain(
-        [MAYOR, MAIN_DETECTIVE, ],
-        OTHER_DETECTIVES,
-        SUSPECTS,
-        FACTORY_WORKERS)))
-
-    addresses = {
-        'Badgers Dene': randrange(40, 200) * [None, ],
-        'Balcombe Close': randrange(40, 200) * [None, ],
-        'Beaconside': randrange(40, 200) * [None, ],
-        'Bowler Street': randrange(40, 200) * [None, ],
-        'Cliff Place': randrange(40, 200) * [None, ],
-        'Corbet Close': randrange(40, 200) * [None, ],
-        'Down Close': randrange(40, 200) * [None, ],
-        'Glan Road': randrange(40, 200) * [None, ],
-        'Glendale': randrange(40, 200) * [None, ],
-        'Harvey Street': randrange(40, 200) * [None, ],
-        'Holmefield Avenue': randrange(40, 200) * [None, ],
-        'Larch Walk': randrange(40, 200) * [None, ],
-        'Moor End': randrange(40, 200) * [None, ],
-        'Sunningdale Drive': randrange(40, 200) * [None, ],
-        'Tamworth Drive': randrange(40, 200) * [None, ],
-        'Valentia Road': randrange(40, 200) * [None, ],
-        'Ventnor Terrace': randrange(40, 200) * [None, ],
-        'Wantage Close': randrange(40, 200) * [None, ],
-        'Wellswood Gardens': randrange(40, 200) * [None, ],
-        'Wilson Gardens': randrange(40, 200) * [None, ],
-    }
+    report = ProfileReport(profile_dir) if report_path or profile_dir else None
+    try:
+        with profile_step(report, 'setup'):
+            town = populate_town(scale)
+    except ValueError as err:
+        raise UsageError(f'Scale is too big: {err}')
 
-    # Assign "notable" people random addresses. Notice that the street number isn't zero-based.
-    street_assignments = choices(list(addresses.keys()), k=len(everyone))
-    for (person, street_name) in zip(everyone, street_assignments):
-        street_number = choice([i + 1 for (i, p) in enumerate(addresses[street_name]) if p is None])
-        person.set_address(street_name, street_number)
-        addresses[street_name][street_number - 1] = person
-
-    # Fill in remaining addresses with random people.
-    for (street_name, street_residents) in addresses.items():
-        for (i, person) in zip(range(len(street_residents)), random_people(everyone)):
-            if street_residents[i]:
-                continue
-            street_residents[i] = person
-            person.set_address(street_name, street_number)
+    phases = () if no_phases else (set(chosen_phases) or range(1, PHASES_COUNT + 1))
+    if resume:
+        phases = set(chosen_phases)
+    if dry_run:
+        # The streets are only ever written concurrently into a repository, and the result is the
+        # same regardless of the number of jobs.
+        with redirect_stdout(sys.stderr):
+            backend = build_mystery(None, town, DRY_RUN_BACKEND, phases, not no_solution, 1,
+                scale=scale)
+        echo(f'Recorded {backend.commits_count} commits and {len(backend.refs)} references',
+            err=True)
+        if manifest_file:
+            write_manifest(manifest_file, town, backend,
+                seed=seed_value.hex(), scale=scale._asdict())
+        secho('Done', fg='green', err=True)
+        return
 
-    repo_dir = Path(repo_dir)
-    if repo_dir.exists():
-        if not force and any(repo_dir.iterdir()):
-            confirm(f"Directory {repo_dir} isn't empty, you sure you want to override it?",
-                abort=True)
-        rmtree(repo_dir)
-
-    secho('Initialization', fg='magenta')
-    echo('Creating repository')
-    repo = Repo.init(repo_dir, mkdir=True)
-    repo.description = f'A Git Murder Mystery ({seed_value.hex()})'
-    repo_root = Path(repo.working_tree_dir)
-
-    inflect = engine()
-    readme = DATA_DIR.joinpath('README.md').read_text()
-    repo_root.joinpath('README.md').write_text(readme)
-    reference_date = DATE_REPORT_WEEK_START - timedelta(days=2)
-    instructions = DATA_DIR.joinpath('instructions.txt').read_text().format(
-        detective=MAIN_DETECTIVE.name,
-        police_branch=POLICE_BRANCH,
-        reference_date=f'{reference_date:%A, %B} {inflect.ordinal(reference_date.day)}')
-    repo_root.joinpath('instructions.txt').write_text(instructions)
-
-    repo.index.add(
-        p.as_posix() for p in repo_root.glob('**/*')
-        if p.is_file() and '.git' not in p.parts)
-
-    echo('Writing residents file')
-    residents = repo_root / 'residents.txt'
-    with residents.open('w') as residents_csv:
-        writer = DictWriter(
-            residents_csv,
-            fieldnames=('Name', 'Address', ),
-            dialect='excel-tab',
-            lineterminator='\n')
-        writer.writeheader()
-        for person in sorted(chain(*addresses.values())):
-            writer.writerow({
-                'Name': person.name,
-                'Address': f'{person.address[1]} {person.address[0]}',
-            })
-    repo.index.add(residents.as_posix())
-
-    git_commit(repo, MAYOR, DATE_START, 'Git Town')
-
-    if not no_phases:
-        phases = (
-            lambda: build_phase_1(repo),
-            lambda: build_phase_2(repo),
-            lambda: build_phase_3(repo, addresses),
-        )
-        chosen_phases = set(chosen_phases) if chosen_phases else range(1, len(phases) + 1)
-        for (i, phase) in enumerate(phases):
-            if i + 1 not in chosen_phases:
-                secho(f'Skipping phase #{i + 1}', fg='cyan')
-                continue
-            secho(f'Phase #{i + 1}', fg='magenta')
-            phase()
+    store = SharedStore.create(store_dir) if store_dir else None
+    if resume:
+        checkpoint.restore()
+    else:
+        repo_dir = Path(repo_dir)
+        if repo_dir.exists():
+            if not force and any(repo_dir.iterdir()):
+                confirm(f"Directory {repo_dir} isn't empty, you sure you want to override it?",
+                    abort=True)
+            rmtree(repo_dir)
+
+        secho('Initialization', fg='magenta')
+        echo('Creating repository')
+        with profile_step(report, 'setup'):
+            repo = Repo.init(repo_dir, mkdir=True, bare=bare)
+            repo.description = f'A Git Murder Mystery ({seed_value.hex()})'
+            if store:
+                store.link(repo)
+        checkpoint = Checkpoint(repo, {
+            'seed': seed_value.hex(),
+            'scale': scale._asdict(),
+            'phases': sorted(phases),
+            'solution': not no_solution,
+            'backend': backend_name,
+            'shared_store': str(store.path) if store else None,
+        })
 
-    if not no_solution:
-        secho('Encoding the solution', fg='magenta')
-        build_solution(repo, addresses)
+    cache = ObjectCache(cache_dir, cache_size * 1024 * 1024) if cache_dir else None
+    build_mystery(repo, town, backend_name, phases, not no_solution, jobs, cache, scale,
+        report, checkpoint)
+    checkpoint.remove()
+
+    if store:
+        echo(f'Sharing objects with {store.path}')
+        shared = store.share(repo)
+        store.repack()
+        echo(f'Added {shared} objects to the shared store')
+
+    if report_path:
+        report.write(report_path, seed=seed_value.hex(), backend=backend_name, jobs=jobs,
+            scale=scale._asdict())
+        echo(f'Profile report written to {report_path}')
+
+    if bundle_path:
+        ctx.invoke(export, repo=repo, bundle_path=bundle_path)
 
     if push_remote:
         while not remote_url:
             remote_url = prompt('Target repository').strip()
-        ctx.invoke(push, repo=repo, url=remote_url)
+        ctx.invoke(push, repo=repo, urls=(remote_url, ))
+
+    secho('Done', fg='green')
+
+def _init_batch_worker():
+    from .mystery import preload_data
+
+    # Each process generates many mysteries, their progress is reported by the parent process.
+    sys.stdout = open(devnull, 'w')
+    preload_data()
+
+@cli.command('generate-batch')
+@argument('output_dir', type=ClickPath(file_okay=False, writable=True))
+@option('--force', '-f', is_flag=True, help='Override mysteries\' directories even if exist.')
+@option('--seed', '-s', 'seed_values', type=bytes.fromhex, metavar='SEED', multiple=True,
+    help='Generate a mystery from this seed (may be repeated).')
+@option('--seeds-file', type=File('r'), help='Read seeds from a file, one per line.')
+@option('--count', '-n', type=IntRange(1), help='Generate this many mysteries from random seeds.')
+@option('--backend', 'backend_name', type=Choice(BACKEND_NAMES), default='fast-import',
+    show_default=True, help='How to write the repositories\' objects and references.')
+@option('--bare', is_flag=True, help='Create bare repositories, without checking out any branch.')
+@option('--jobs', '-j', type=IntRange(1), default=cpu_count(), show_default='CPU count',
+    help='Number of mysteries to generate at once.')
+@option('--scale', type=ScaleType(), default='small', show_default=True, metavar='PROFILE|N',
+    help='Make the mysteries bigger, by a named profile or by multiplying all of their sizes.')
+@option('--shared-store', 'store_dir', type=ClickPath(file_okay=False, writable=True),
+    envvar='GITSTERY_SHARED_STORE',
+    help='Keep the objects mysteries share in this object store, linked as an alternate.')
+def generate_batch(output_dir, force, seed_values, seeds_file, count, backend_name, bare, jobs,
+        scale, store_dir):
+    """Generate many Git Murder Mysteries into OUTPUT_DIR, one for each seed.
+
+    A `manifest.json` is written to OUTPUT_DIR mapping each seed to its repository's absolute path,
+    its references and how long it took to generate.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from .backends import BACKENDS
+    from .mystery import preload_data, generate_mystery
+    from .store import SharedStore
+
+    seed_values = list(seed_values)
+    if seeds_file:
+        seed_values.extend(bytes.fromhex(line) for line in seeds_file.read().split())
+    if count:
+        seed_values.extend(urandom(10) for _ in range(count))
+    if not seed_values:
+        raise UsageError('No seeds given, use --seed, --seeds-file or --count')
+    if bare and not BACKENDS[backend_name].supports_bare:
+        raise UsageError(f'The {backend_name} backend requires a working tree')
+    seed_values = list(dict.fromkeys(seed_values))
+
+    output_dir = Path(output_dir)
+    repo_dirs = [output_dir / seed_value.hex() for seed_value in seed_values]
+    existing = [repo_dir for repo_dir in repo_dirs if repo_dir.exists()]
+    if existing:
+        if not force:
+            confirm(f'{len(existing)} mysteries already exist in {output_dir}, override them?',
+                abort=True)
+        for repo_dir in existing:
+            rmtree(repo_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # Created once, before any of the processes share their mysteries' objects with it.
+    store = SharedStore.create(store_dir) if store_dir else None
+
+    start = perf_counter()
+    preload_data()
+    mysteries = {}
+    with ProcessPoolExecutor(jobs, initializer=_init_batch_worker) as pool:
+        futures = dict(
+            (pool.submit(generate_mystery, repo_dir, seed_value, backend_name, bare, scale,
+                store_dir), seed_value)
+            for (repo_dir, seed_value) in zip(repo_dirs, seed_values))
+        for future in as_completed(futures):
+            seed_value = futures[future]
+            try:
+                mystery = future.result()
+            except Exception as err:
+                secho(f'{seed_value.hex()}: Failed ({err})', fg='red')
+                mysteries[seed_value] = {'seed': seed_value.hex(), 'error': str(err)}
+                continue
+            echo(f'{seed_value.hex()}: {mystery["path"]} ({mystery["seconds"]}s)')
+            mysteries[seed_value] = mystery
+
+    if store:
+        store.repack()
 
+    manifest = output_dir / 'manifest.json'
+    manifest.write_text(json.dumps({
+        'backend': backend_name,
+        'scale': scale._asdict(),
+        'shared_store': str(store.path) if store else None,
+        'seconds': round(perf_counter() - start, 3),
+        'mysteries': [mysteries[seed_value] for seed_value in seed_values],
+    }, indent=2))
+    echo(f'Manifest written to {manifest}')
+
+    failed = sum(1 for mystery in mysteries.values() if 'error' in mystery)
+    if failed:
+        secho(f'{failed} of {len(mysteries)} mysteries failed', fg='red')
+        sys.exit(1)
     secho('Done', fg='green')
 
 @cli.command()
-@argument('repo', type=Repo, envvar='GITSTERY_TEMP_DIR')
-@argument('url', envvar='GITSTERY_TARGET_REPO')
-def push(repo, url):
-    """Update the remote repository at URL from the mystery repository at REPO."""
-    if 'origin' in repo.remotes:
-        repo.delete_remote('origin')
-    origin = repo.create_remote('origin', url)
+@argument('pool_dir', type=ClickPath(file_okay=False, writable=True))
+@option('--size', '-n', type=IntRange(1), default=10, show_default=True,
+    help='Number of mysteries to keep ready.')
+@option('--jobs', '-j', type=IntRange(1), default=cpu_count(), show_default='CPU count',
+    help='Number of mysteries to generate at once.')
+@option('--backend', 'backend_name', type=Choice(BACKEND_NAMES), default='fast-import',
+    show_default=True, help='How to write the mysteries\' objects and references.')
+@option('--scale', type=ScaleType(), default='small', show_default=True, metavar='PROFILE|N',
+    help='Make the mysteries bigger, by a named profile or by multiplying all of their sizes.')
+@option('--served-max-age', type=IntRange(1), default=SERVED_MAX_AGE_MINUTES, show_default=True,
+    metavar='MINUTES', help='How long a mystery served by its path is kept.')
+@option('--served-max-count', type=IntRange(1), default=SERVED_MAX_COUNT, show_default=True,
+    help='Number of mysteries served by their paths to keep at most.')
+@option('--host', default='127.0.0.1', show_default=True, help='Address to listen on.')
+@option('--port', type=IntRange(0, 65535), default=8000, show_default=True,
+    help='Port to listen on.')
+def serve(pool_dir, size, jobs, backend_name, scale, served_max_age, served_max_count, host, port):
+    """Serve mysteries over HTTP, from a pool of mysteries generated ahead of time in POOL_DIR.
+
+    `GET /mystery` answers with a mystery repository's path (as JSON), `GET /mystery.bundle` with
+    its bundle and `GET /metrics` with the pool's depth and latencies. The pool is refilled in the
+    background as mysteries are served, requests never wait for a mystery to be generated.
+
+    A path returned by `GET /mystery` stays valid for `--served-max-age` minutes, unless more than
+    `--served-max-count` mysteries were served after it. The expired ones are deleted as the pool is
+    refilled and when the server is started.
+    """
+    from signal import signal, SIGTERM
+    from .mystery import preload_data
+    from .serve import MysteryPool, MysteryServer
 
+    # Being terminated stops the server the same as an interrupt, so the ready mysteries are kept.
+    signal(SIGTERM, lambda *_: sys.exit(0))
+    preload_data()
+    pool = MysteryPool(pool_dir, size, jobs, backend_name, scale, initializer=_init_batch_worker,
+        served_max_age=served_max_age, served_max_count=served_max_count)
     try:
-        secho(f'Pushing {repo.working_tree_dir} to {url}', fg='magenta')
-        pushed_refs = origin.push(repo.branches, force=True, tags=True)
-        for ref in pushed_refs:
-            summary = ref.summary.strip('\n')
-            echo(f'  {ref.local_ref} {summary}')
+        server = MysteryServer((host, port), pool)
+        secho(f'Serving mysteries from {pool_dir} on http://{host}:{server.server_port}',
+            fg='magenta')
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
     finally:
-        repo.delete_remote('origin')
+        echo('Waiting for the mysteries being generated')
+        pool.close()
+
+def _push_target(repo, url, refs):
+    # Only the references which the remote doesn't already have (pointing at the same objects) are
+    # pushed, the rest are left as they are.
+    from .git_utils import remote_refs, push_refs
+
+    current = remote_refs(repo, url)
+    changed = [ref for (ref, hexsha) in refs.items() if current.get(ref) != hexsha]
+    return push_refs(repo, url, changed) if changed else {}
 
 @cli.command()
-@argument('repository', envvar='GITSTERY_TARGET_REPO')
-def verify(repository):
-    """Verify a mystery REPOSITORY was built properly."""
+@argument('repo', type=RepositoryType(), envvar='GITSTERY_TEMP_DIR')
+@argument('urls', metavar='URL...', nargs=-1, required=True, envvar='GITSTERY_TARGET_REPO')
+@option('--repack', is_flag=True,
+    help='Repack the repository, with reachability bitmaps, before pushing it.')
+@option('--jobs', '-j', type=IntRange(1), show_default='all of them',
+    help='Number of remote repositories to push to at once.')
+def push(repo, urls, repack, jobs):
+    """Update the remote repositories at URL (one or more) from the mystery repository at REPO.
+
+    Only the branches and tags which changed are pushed, to all of the remote repositories at once.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from git import GitCommandError
+    from .git_utils import local_refs
+
+    if repack:
+        # A single pack with a bitmap lets `git push` find the objects it sends without walking the
+        # mystery's history (which would otherwise be done once for every remote).
+        secho(f'Repacking {repo.git_dir}', fg='magenta')
+        repo.git.repack('-a', '-d', '-q', '--write-bitmap-index')
+
+    urls = list(dict.fromkeys(urls))
+    refs = local_refs(repo)
+    secho(f'Pushing {repo.working_tree_dir or repo.git_dir}', fg='magenta')
+    failed = 0
+    with ThreadPoolExecutor(jobs or len(urls)) as pool:
+        futures = dict((pool.submit(_push_target, repo, url, refs), url) for url in urls)
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                pushed_refs = future.result()
+            except GitCommandError as err:
+                secho(f'{url}: Failed', fg='red')
+                echo(err.stderr, err=True)
+                failed += 1
+                continue
+
+            if not pushed_refs:
+                echo(f'{url}: Up to date')
+                continue
+            echo(f'{url}: Pushed {len(pushed_refs)} references')
+            for (ref, (_, summary)) in pushed_refs.items():
+                echo(f'  {ref} {summary}')
+
+    if failed:
+        secho(f'Failed to push to {failed} of {len(urls)} remote repositories', fg='red')
+        sys.exit(1)
+
+@cli.command()
+@argument('repo', type=RepositoryType(), envvar='GITSTERY_TEMP_DIR')
+@argument('bundle_path', metavar='BUNDLE', type=ClickPath(dir_okay=False, writable=True))
+@option('--window', type=IntRange(1), default=BUNDLE_DELTA_WINDOW, show_default=True,
+    help='Number of objects to consider when looking for deltas.')
+@option('--depth', type=IntRange(1), default=BUNDLE_DELTA_DEPTH, show_default=True,
+    help='Maximal length of delta chains.')
+def export(repo, bundle_path, window=BUNDLE_DELTA_WINDOW, depth=BUNDLE_DELTA_DEPTH):
+    """Export the mystery repository at REPO as a single BUNDLE file.
+
+    The bundle holds all of the mystery's branches and tags and can be cloned like any repository.
+    Its objects are packed anew in a temporary mirror, the repository itself is left as it is.
+    """
+    from .git_utils import export_bundle
+
+    secho(f'Exporting {repo.git_dir} to {bundle_path}', fg='magenta')
+    export_bundle(repo, bundle_path, window, depth)
+    echo(f'  {Path(bundle_path).stat().st_size // 1024}KiB')
+
+@cli.command()
+@argument('repos', metavar='REPO...', type=RepositoryType(), nargs=-1, required=True)
+def detach(repos):
+    """Make the mystery repositories at REPO (one or more) independent of any shared store.
+
+    All of the objects a repository borrows from the store are copied into it, after which it can be
+    moved, copied or archived on its own (and the store can be removed once no repository is linked
+    to it).
+    """
+    from .store import detach as detach_repository
+
+    for repo in repos:
+        path = repo.working_tree_dir or repo.git_dir
+        if detach_repository(repo):
+            echo(f'{path}: Detached')
+        else:
+            echo(f'{path}: Not linked to a shared store')
+
+def verify_mystery(repository):
+    """Verify a mystery repository (a local path or a remote URL) was built properly."""
+    from git import Repo, GitCommandError
+    from .solution import verify_repository
+
     uri = urlparse(repository)
-    if uri.scheme.lower() in ('http', 'https') or uri.path.startswith('git@'):
-        repo_context = clone_repository(repository)
-    else:
+    if uri.scheme.lower() in ('http', 'https', 'ssh', 'git', 'file') or uri.path.startswith('git@'):
         try:
-            # This also takes care of `file://` URIs.
-            repo_context = nullcontext(Repo(uri.path))
-        except:
-            echo(f'{repository}: Not a git repository')
-            sys.exit(1)
+            with fetch_repository(repository) as repo:
+                return verify_repository(repo)
+        except GitCommandError as err:
+            # Reported with the rest of the verification's output, which batch verification
+            # captures. GitPython quotes git's error output, the first line of which is the reason.
+            reason = err.stderr.strip().removeprefix("stderr: '").removesuffix("'").splitlines()
+            echo(f'{repository}: Failed to fetch ({reason[0] if reason else err})')
+            return False
 
-    with repo_context as repo:
-        if 'master' != repo.head.ref.name:
-            echo('Checking out `master`')
-            repo.heads.master.checkout()
+    try:
+        repo = Repo(uri.path)
+    except:
+        echo(f'{repository}: Not a git repository')
+        return False
 
-        if repo.head.is_detached:
-            echo("Repository's head is detached")
-            sys.exit(1)
-        if repo.is_dirty():
-            echo('Repository is dirty')
-            sys.exit(1)
+    if 'master' != repo.head.ref.name:
+        echo('Checking out `master`')
+        repo.heads.master.checkout()
 
-        if not verify_repository(repo):
+    if repo.head.is_detached:
+        echo("Repository's head is detached")
+        return False
+    if repo.is_dirty():
+        echo('Repository is dirty')
+        return False
+
+    return verify_repository(repo)
+
+def _verify_batch_worker(repository):
+    # The verification's output is kept to explain failures, rather than interleaving with others'.
+    start = perf_counter()
+    output = StringIO()
+    with redirect_stdout(output):
+        try:
+            passed = verify_mystery(repository)
+        except Exception as err:
+            echo(f'{type(err).__name__}: {err}')
+            passed = False
+
+    result = {
+        'repository': repository,
+        'passed': passed,
+        'seconds': round(perf_counter() - start, 3),
+    }
+    if not passed:
+        lines = output.getvalue().splitlines()
+        result['error'] = lines[-1] if lines else 'Unknown error'
+    return result
+
+def _manifest_repositories(manifest):
+    """Read the repositories to verify from a file, one per line or a `generate-batch` manifest."""
+    text = manifest.read()
+    try:
+        mysteries = json.loads(text)['mysteries']
+    except (ValueError, TypeError, KeyError):
+        return text.split()
+    # Mysteries which failed to generate have no repository to verify.
+    return [mystery['path'] for mystery in mysteries if 'path' in mystery]
+
+@cli.command()
+@argument('repositories', metavar='REPOSITORY...', nargs=-1, envvar='GITSTERY_TARGET_REPO')
+@option('--manifest', type=File('r'),
+    help='Verify the repositories in a file, one per line or a `generate-batch` manifest.')
+@option('--jobs', '-j', type=IntRange(1), default=cpu_count(), show_default='CPU count',
+    help='Number of repositories to verify at once.')
+@option('--report', 'report_file', type=File('w'), metavar='PATH',
+    help='Write each repository\'s result and timing as JSON (`-` for the standard output).')
+def verify(repositories, manifest, jobs, report_file):
+    """Verify mystery REPOSITORY (or many of them) was built properly.
+
+    Remote repositories (including `file://` URLs) are verified without cloning them, only what's
+    needed is fetched.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    repositories = list(repositories)
+    if manifest:
+        repositories.extend(_manifest_repositories(manifest))
+    if not repositories:
+        raise UsageError('No repositories given, pass them as arguments or use --manifest')
+    repositories = list(dict.fromkeys(repositories))
+
+    if 1 == len(repositories) and not report_file:
+        if not verify_mystery(repositories[0]):
             sys.exit(1)
+        return
+
+    # The results are reported to the standard error, in case the report is written to the output.
+    start = perf_counter()
+    results = {}
+    with ProcessPoolExecutor(min(jobs, len(repositories))) as pool:
+        futures = dict(
+            (pool.submit(_verify_batch_worker, repository), repository)
+            for repository in repositories)
+        for future in as_completed(futures):
+            result = future.result()
+            if result['passed']:
+                echo(f'{result["repository"]}: Passed ({result["seconds"]}s)', err=True)
+            else:
+                secho(f'{result["repository"]}: Failed ({result["error"]})', fg='red', err=True)
+            results[futures[future]] = result
+
+    failed = sum(1 for result in results.values() if not result['passed'])
+    if report_file:
+        report_file.write(json.dumps({
+            'seconds': round(perf_counter() - start, 3),
+            'passed': len(results) - failed,
+            'failed': failed,
+            'repositories': [results[repository] for repository in repositories],
+        }, indent=2) + '\n')
+
+    if failed:
+        secho(f'{failed} of {len(results)} repositories failed', fg='red', err=True)
+        sys.exit(1)
+    secho('Done', fg='green', err=True)
@@ -1,4 +1,5 @@
 from pathlib import Path
+from collections import namedtuple
 from datetime import datetime, timedelta
 
 COMMIT_MSG_WIDTH = 100
@@ -16,5 +17,38 @@ DATE_REPORT_WEEK_START = DATE_REPORT.replace(hour=0, minute=0) \
     - timedelta(days=DATE_REPORT.weekday())
 DATE_REPORT_WEEK_END = DATE_REPORT_WEEK_START + timedelta(days=6)
 
+PHASES_COUNT = 3
+BACKEND_NAMES = ('index', 'fast-import')
+# Not a real backend, it only records what the others would write (see `generate --dry-run`).
+DRY_RUN_BACKEND = 'dry-run'
+
+# How many times bigger than the original mystery each of its parts is: the police reports of the
+# first phase, the factory's access logs of the second and the houses on each street of the third.
+Scale = namedtuple('Scale', ('reports', 'access_logs', 'houses'), defaults=(1, 1, 1))
+SCALE_PROFILES = {
+    'small': Scale(),
+    'medium': Scale(10, 10, 10),
+    'large': Scale(100, 50, 100),
+    # About a million police reports, with as many houses as there are names for residents.
+    'huge': Scale(5700, 100, 400),
+}
+
+# How many commits' texts are prepared ahead of the ones being written (see `utils.pipelined`).
+PIPELINE_DEPTH = 64
+
+# The mysteries' commit messages are all taken from the same book, so they delta-compress well given
+# a large enough window.
+BUNDLE_DELTA_WINDOW = 250
+BUNDLE_DELTA_DEPTH = 50
+
+# Past this many packs (one for each mystery shared) the shared object store is repacked into one,
+# the same as git's own `gc.autoPackLimit`.
+SHARED_STORE_PACK_LIMIT = 50
+
+# Mysteries served by their paths are kept for learners to clone for this long, but no more than this
+# many of them (the oldest are deleted first).
+SERVED_MAX_AGE_MINUTES = 60
+SERVED_MAX_COUNT = 100
+
 POLICE_BRANCH = 'gtpd-archive'
 ACCESS_POINT_OF_INTEREST = 'BACKDOOR_332'
@@ -1,57 +1,80 @@
-from itertools import islice
+from functools import lru_cache
 from datetime import timedelta
-from random import choice, randrange
-from textwrap import dedent
+from random import randrange, random
 from .defines import DATA_DIR, DATE_START
-from .people import Person
+from .book import Paragraphs
 
-def random_ids():
+def random_ids(scale=1):
+    # The range of IDs grows with the number of IDs drawn from it, so it never runs out.
     past = set()
     while True:
-        n = randrange(10000, 999999)
+        n = randrange(10000, 999999 * scale)
         if n not in past:
             yield n
             past.add(n)
 
 def random_people(people_of_interest):
-    providers = ['gitgle.com', 'rebase.org', 'committers.org', 'thegit.com', ]
-    given_names_path = DATA_DIR / 'given-names.txt'
-    surnames_path = DATA_DIR / 'surnames.txt'
-    given_names = given_names_path.read_text().splitlines()
-    surnames = surnames_path.read_text().splitlines()
-    people = {tuple(p.name.split()) for p in people_of_interest}
-    while True:
-        given_name = choice(given_names)
-        surname = choice(surnames)
-        if (given_name, surname) in people:
-            continue
+    """Generate distinct random people, none of which shares a name with the people of interest.
 
-        email = f'{given_name[0].lower()}{surname.lower()}@{choice(providers)}'
-        yield Person(f'{given_name} {surname}', email)
-        people.add((given_name, surname))
+    Names are drawn without replacement from all (given name, surname) pairs, each pair identified
+    by its index. That way drawing a name takes the same time however many were already drawn.
+    People are generated as the IDs of their names (see `Town`).
+    """
+    given_names = data_names('given-names.txt')
+    surnames = data_names('surnames.txt')
+    excluded = set()
+    for person in people_of_interest:
+        (given_name, surname) = person.name.split()
+        if given_name in given_names and surname in surnames:
+            excluded.add(given_names.index(given_name) * len(surnames) + surnames.index(surname))
 
-def random_paragraphs(count = -1):
-    global _paragraphs
-    if not _paragraphs:
-        # Load book for random paragraphs.
-        book_path = DATA_DIR / 'book.txt'
-        with book_path.open('r') as book:
-            # Split the book by paragraphs, we drop the first 50 "paragraphs" to skip the title, TOC,
-            # and parts of the exposition. We also drop "empty" paragraph, stories and chapter titles.
-            # No need to wrap the paragraph right now, `git_commit` takes care of that.
-            _paragraphs = (' '.join(dedent(p).splitlines()) for p in book.read().split('\n\n'))
-            _paragraphs = [p for p in islice(_paragraphs, 50, None)
-                if p and not (p.startswith(' ') or p.startswith('CHAPTER'))]
+    for name_id in random_permutation(len(given_names) * len(surnames)):
+        if name_id not in excluded:
+            yield name_id
 
+def random_permutation(n):
+    """Lazily generate a random permutation of `range(n)`.
+
+    This is a Fisher-Yates shuffle which only keeps track of the positions that were swapped, so
+    memory grows with the number of values drawn rather than with `n`.
+    """
+    swapped = {}
+    for i in range(n):
+        j = randrange(i, n)
+        current = swapped.pop(i, i)
+        if i == j:
+            yield current
+        else:
+            yield swapped.get(j, j)
+            swapped[j] = current
+
+def random_paragraphs(count = -1):
+    # The paragraphs are already wrapped, no need for `git_commit` to wrap them again.
+    paragraphs = load_paragraphs()
     if count is None:
-        return choice(_paragraphs)
+        return paragraphs.join(randrange(len(paragraphs)))
     if count <= 0:
         count = 2 + randrange(5)
-    index = randrange(len(_paragraphs))
-    return '\n\n'.join(_paragraphs[index:index + count])
+    index = randrange(len(paragraphs))
+    return paragraphs.join(index, count)
+
+def load_paragraphs():
+    global _paragraphs
+    if not _paragraphs:
+        _paragraphs = Paragraphs.load()
+    return _paragraphs
 
 _paragraphs = None
 
+@lru_cache(maxsize=None)
+def data_lines(file_name):
+    return DATA_DIR.joinpath(file_name).read_text().splitlines()
+
+@lru_cache(maxsize=None)
+def data_names(file_name):
+    # Some given names appear on both the boys' and the girls' lists.
+    return tuple(dict.fromkeys(data_lines(file_name)))
+
 def random_datetime(date_1, date_2=None, /, *, hour_min=8, hour_max=18):
     (start, end) = (date_1, date_2) if date_2 else (DATE_START, date_1)
     delta = end - start
@@ -61,6 +84,21 @@ def random_datetime(date_1, date_2=None, /, *, hour_min=8, hour_max=18):
         minutes=randrange(0, 59))
 
 def random_datetimes(count, date_1, date_2 = None, /, *, hour_min=8, hour_max=18):
+    """Generate `count` random datetimes (distributed as `random_datetime`'s are) in order.
+
+    Instead of drawing all of the datetimes and sorting them, each one is drawn as the earliest of
+    the ones remaining. That way they're generated one at a time, in constant memory.
+    """
     (start, end) = (date_1, date_2) if date_2 else (DATE_START, date_1)
-    return sorted(random_datetime(start, end, hour_min=hour_min, hour_max=hour_max)
-        for _ in range(count))
+    days = max((end - start).days, 1)
+    (hours, minutes) = (hour_max - hour_min, 59)
+    total_minutes = days * hours * minutes
+    start = start.replace(hour=hour_min, minute=0)
+
+    point = 0.0
+    for remaining in range(count, 0, -1):
+        # The minimum of `remaining` points uniformly distributed between `point` and 1.
+        point = 1 - (1 - point) * random() ** (1 / remaining)
+        (day, minute) = divmod(min(int(point * total_minutes), total_minutes - 1), hours * minutes)
+        (hour, minute) = divmod(minute, minutes)
+        yield start + timedelta(days=day, hours=hour, minutes=minute)
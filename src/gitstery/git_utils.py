@@ -1,17 +1,272 @@
 from functools import wraps
+from pathlib import Path
+from collections import namedtuple, defaultdict
 from contextlib import contextmanager
+from subprocess import PIPE
+from calendar import timegm
+from hashlib import sha1
+from struct import pack
+from zlib import compress
+from io import BytesIO
+from tempfile import TemporaryFile, TemporaryDirectory
+from gitdb import IStream
+from .defines import BUNDLE_DELTA_WINDOW, BUNDLE_DELTA_DEPTH
 from .utils import wrap_paragraphs
 
-def git_commit(repo, author, date, title, body=''):
+TREE_MODE = 0o40000
+FILE_MODE = 0o100644
+
+def commit_message(title, body=''):
     # We wrap individual paragraphs in the body, otherwise it'll all get squashed into single
     # wrapped paragraph.
+    return f'{title}\n\n{wrap_paragraphs(body)}' if body else title
+
+def git_date(date):
+    # All of the mystery's dates are naive and treated as UTC, same as GitPython does when given an
+    # ISO formatted date without an offset.
+    return f'{timegm(date.timetuple())} +0000'
+
+def object_hash(object_type, data):
+    return sha1(b'%s %d\0' % (object_type.encode(), len(data)) + data).hexdigest()
+
+def blob_hash(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return object_hash('blob', data)
+
+def tree_object(entries):
+    # Trees are sorted by name, with sub-trees compared as if their names ended with a slash.
+    def _entry_key(entry):
+        (mode, name, _) = entry
+        return name.encode() + (b'/' if TREE_MODE == mode else b'')
+
+    return b''.join(
+        b'%o %s\0%s' % (mode, name.encode(), binsha)
+        for (mode, name, binsha) in sorted(entries, key=_entry_key))
+
+def tree_hash(files):
+    """Compute the ID of the tree holding the given files (mapping paths to blobs' IDs)."""
+    entries = []
+    sub_trees = defaultdict(dict)
+    for (path, hexsha) in files.items():
+        (name, _, sub_path) = path.partition('/')
+        if sub_path:
+            sub_trees[name][sub_path] = hexsha
+        else:
+            entries.append((FILE_MODE, name, bytes.fromhex(hexsha)))
+    entries.extend(
+        (TREE_MODE, name, bytes.fromhex(tree_hash(sub_files)))
+        for (name, sub_files) in sub_trees.items())
+    return object_hash('tree', tree_object(entries))
+
+def commit_object(tree, parents, author, date, message):
+    return '\n'.join([
+        f'tree {tree}',
+        *(f'parent {parent}' for parent in parents),
+        f'author {author.name} <{author.email}> {git_date(date)}',
+        f'committer {author.name} <{author.email}> {git_date(date)}',
+        '',
+        message,
+    ]).encode()
+
+def store_object(odb, object_type, data):
+    return odb.store(IStream(object_type, len(data), BytesIO(data))).hexsha.decode()
+
+class PackWriter():
+    """Write objects into a single new pack of the repository, rather than a file for each.
+
+    Objects are appended (as they are, without deltas) to a temporary file, which `git index-pack`
+    indexes and moves into the repository once the writer is closed. Only the IDs of the objects
+    written are kept, so the same object isn't written twice.
+    """
+    PACK_TYPES = {'commit': 1, 'tree': 2, 'blob': 3, 'tag': 4, }
+
+    def __init__(self, repo):
+        self.__repo = repo
+        self.__pack = None
+        self.__written = set()
+
+    def __enter__(self):
+        self.__pack = TemporaryFile()
+        # The header's objects count is only written once they're all known.
+        self.__pack.write(pack('>4sII', b'PACK', 2, 0))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.__pack:
+            if exc_type is None:
+                self.__pack.seek(0)
+                self.__pack.write(pack('>4sII', b'PACK', 2, len(self.__written)))
+                self.__pack.seek(0)
+                digest = sha1()
+                for chunk in iter(lambda: self.__pack.read(1 << 20), b''):
+                    digest.update(chunk)
+                self.__pack.write(digest.digest())
+                self.__pack.seek(0)
+                self.__repo.git.execute(['git', 'index-pack', '--stdin'], istream=self.__pack)
+
+    def store(self, object_type, data):
+        hexsha = object_hash(object_type, data)
+        if hexsha not in self.__written:
+            self.__written.add(hexsha)
+            # "<type and size>" as a variable-length number, 4 bits of the size in the first byte
+            # and 7 in each of the rest, and then the compressed data.
+            size = len(data)
+            header = bytearray([self.PACK_TYPES[object_type] << 4 | size & 0x0f])
+            size >>= 4
+            while size:
+                header[-1] |= 0x80
+                header.append(size & 0x7f)
+                size >>= 7
+            self.__pack.write(header)
+            self.__pack.write(compress(data))
+        return hexsha
+
+# A commit as read by `ObjectReader`, dates are seconds since the epoch.
+CommitInfo = namedtuple('CommitInfo',
+    ('hexsha', 'tree', 'parents', 'author', 'authored_date', 'committed_date', 'message'))
+
+class ObjectReader():
+    """Read objects through a single, long-lived, `git cat-file --batch` process.
+
+    Objects can be named by anything `git cat-file` accepts (such as
+    `street/glendale~12:investigate`), in which case they're resolved by git itself.
+    """
+    def __init__(self, repo):
+        self.__process = repo.git.cat_file('--batch', as_process=True, istream=PIPE)
+        self.__trees = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__process.stdin.close()
+        self.__process.wait()
+
+    def read(self, name):
+        """Read an object, returning its ID, type and contents.
+
+        Raises a `KeyError` if there's no such object.
+        """
+        self.__process.stdin.write(f'{name}\n'.encode())
+        self.__process.stdin.flush()
+        header = self.__process.stdout.readline().decode().split()
+        if 3 != len(header):
+            # Either "<name> missing" or "<name> ambiguous".
+            raise KeyError(name)
+        (hexsha, object_type, size) = header
+        # The contents are followed by a newline.
+        data = self.__process.stdout.read(int(size) + 1)[:-1]
+        return (hexsha, object_type, data)
+
+    def text(self, name):
+        (_, _, data) = self.read(name)
+        return data.decode()
+
+    def commit(self, name):
+        (hexsha, _, data) = self.read(name)
+        (headers, _, message) = data.decode().partition('\n\n')
+        (tree, parents, author, authored_date, committed_date) = (None, [], None, None, None)
+        for header in headers.splitlines():
+            (key, _, value) = header.partition(' ')
+            if 'tree' == key:
+                tree = value
+            elif 'parent' == key:
+                parents.append(value)
+            elif key in ('author', 'committer'):
+                # "<name> <<email>> <timestamp> <offset>"
+                (identity, timestamp, _) = value.rsplit(' ', 2)
+                if 'author' == key:
+                    (author, authored_date) = (identity.split(' <')[0], int(timestamp))
+                else:
+                    committed_date = int(timestamp)
+        return CommitInfo(hexsha, tree, parents, author, authored_date, committed_date, message)
+
+    def tree(self, name):
+        """Read a tree, mapping each of its entries' names to their modes and IDs."""
+        if name not in self.__trees:
+            (_, _, data) = self.read(name)
+            entries = {}
+            start = 0
+            while start < len(data):
+                # "<mode> <name>\0<binary ID>"
+                name_end = data.index(b'\0', start)
+                (mode, entry_name) = data[start:name_end].split(b' ', 1)
+                start = name_end + 21
+                entries[entry_name.decode()] = (int(mode, 8), data[name_end + 1:start].hex())
+            self.__trees[name] = entries
+        return self.__trees[name]
+
+    def history(self, name):
+        """Walk all of the commits reachable from a commit, each one only once."""
+        seen = set()
+        pending = [name, ]
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            commit = self.commit(name)
+            seen.add(commit.hexsha)
+            yield commit
+            pending.extend(reversed(commit.parents))
+
+def git_commit(repo, author, date, title, body=''):
     return repo.index.commit(
-        f'{title}\n\n{wrap_paragraphs(body)}' if body else title,
+        commit_message(title, body),
         author=author.actor,
         author_date=date.isoformat(),
         committer=author.actor,
         commit_date=date.isoformat())
 
+def export_bundle(repo, bundle_path, window=BUNDLE_DELTA_WINDOW, depth=BUNDLE_DELTA_DEPTH):
+    # The bundle reuses the deltas already in the packs it's made of, so we recompute them first.
+    # That's done in a temporary mirror borrowing the repository's objects, leaving its own packs
+    # untouched. The mirror packs all of the objects (including those the repository borrows from a
+    # shared store) and then stops borrowing them, so the bundle only reuses the new deltas.
+    with TemporaryDirectory() as mirror_dir:
+        mirror = repo.clone(mirror_dir, mirror=True, shared=True)
+        mirror.git.repack('-a', '-d', '-f', '-q', f'--window={window}', f'--depth={depth}')
+        (Path(mirror.git_dir) / 'objects' / 'info' / 'alternates').unlink()
+        # Tags must be included as well, they're required to solve the mystery. Git runs in the
+        # mirror, so a relative path must be resolved first.
+        mirror.git.bundle('create', str(Path(bundle_path).resolve()), '--branches', '--tags',
+            'HEAD')
+
+def git_stdin(repo, args, lines):
+    """Run a git command which reads its input (given as lines) from the standard input."""
+    with TemporaryFile() as stdin:
+        stdin.write(''.join(f'{line}\n' for line in lines).encode())
+        stdin.seek(0)
+        return repo.git.execute(['git', *args], istream=stdin)
+
+def local_refs(repo):
+    """Map the repository's branches and tags to the objects they point at."""
+    lines = repo.git.for_each_ref('--format=%(objectname)\t%(refname)', 'refs/heads', 'refs/tags')
+    return dict(reversed(line.split('\t')) for line in lines.splitlines())
+
+def remote_refs(repo, url):
+    """Map the branches and tags of the repository at URL to the objects they point at."""
+    lines = repo.git.ls_remote('--heads', '--tags', url)
+    # Annotated tags are listed again, peeled, but none of the mystery's tags are annotated.
+    return dict(reversed(line.split('\t')) for line in lines.splitlines()
+        if not line.endswith('^{}'))
+
+def push_refs(repo, url, refs):
+    """Force-push references to the repository at URL, returning each one's flag and summary.
+
+    The flags are those of `git push --porcelain` (such as `*` for a new reference or `+` for a
+    forced update).
+    """
+    output = repo.git.push('--porcelain', url, *(f'+{ref}:{ref}' for ref in refs))
+    results = {}
+    for line in output.splitlines():
+        # "<flag>\t<from>:<to>\t<summary>", between the target's URL and "Done".
+        fields = line.split('\t')
+        if 3 == len(fields):
+            (flag, refspec, summary) = fields
+            results[refspec.partition(':')[2]] = (flag, summary)
+    return results
+
 @contextmanager
 def restore_head(repo):
     prev_head = repo.head.reference
@@ -23,10 +278,8 @@ def restore_head(repo):
 def in_branch(name):
     def _in_branch_decorator(func):
         @wraps(func)
-        def _switch_branches(repo, *args, **kwargs):
-            with restore_head(repo):
-                new_branch = repo.create_head(name)
-                new_branch.checkout()
-                func(repo, *args, **kwargs)
+        def _switch_branches(backend, *args, **kwargs):
+            with backend.branch(name):
+                func(backend, *args, **kwargs)
         return _switch_branches
     return _in_branch_decorator
@@ -0,0 +1,267 @@
+import json
+from itertools import chain
+from pathlib import Path
+from datetime import timedelta
+from random import seed, choices, randrange
+from io import StringIO
+from csv import DictWriter
+from time import perf_counter
+from click import echo, secho
+from git import Repo
+from .defines import DATA_DIR, DATE_START, DATE_REPORT_WEEK_START, POLICE_BRANCH, Scale
+from .people import MAYOR, MAIN_DETECTIVE, OTHER_DETECTIVES, SUSPECTS, FACTORY_WORKERS
+from .utils import inflect_engine
+from .fillers import random_people, load_paragraphs, data_names
+from .town import Town
+from .git_utils import blob_hash
+from .backends import BACKENDS
+from .phases import build_phase_1, build_phase_2, build_phase_3
+from .solution import build_solution
+from .store import SharedStore
+from .profiling import profile_step
+
+STREETS = (
+    'Badgers Dene',
+    'Balcombe Close',
+    'Beaconside',
+    'Bowler Street',
+    'Cliff Place',
+    'Corbet Close',
+    'Down Close',
+    'Glan Road',
+    'Glendale',
+    'Harvey Street',
+    'Holmefield Avenue',
+    'Larch Walk',
+    'Moor End',
+    'Sunningdale Drive',
+    'Tamworth Drive',
+    'Valentia Road',
+    'Ventnor Terrace',
+    'Wantage Close',
+    'Wellswood Gardens',
+    'Wilson Gardens',
+)
+
+def preload_data():
+    """Load the data files used by the generation, so forked processes won't load them again."""
+    load_paragraphs()
+    data_names('given-names.txt')
+    data_names('surnames.txt')
+
+class FreeHouses():
+    """The free houses of a street, ordered by their numbers.
+
+    The houses are counted by a Fenwick tree, so both finding the n-th free house and taking it are
+    logarithmic in the street's length.
+    """
+    def __init__(self, length):
+        self.__length = length
+        self.__count = length
+        self.__tree = [0, ] + [i & -i for i in range(1, length + 1)]
+        self.__top = 1 << (length.bit_length() - 1) if length else 0
+
+    def __len__(self):
+        return self.__count
+
+    def take(self, index):
+        """Take the `index`-th free house, returning its street number (which isn't zero-based)."""
+        (position, step) = (0, self.__top)
+        while step:
+            if position + step <= self.__length and self.__tree[position + step] <= index:
+                position += step
+                index -= self.__tree[position]
+            step >>= 1
+
+        street_number = position + 1
+        i = street_number
+        while i <= self.__length:
+            self.__tree[i] -= 1
+            i += i & -i
+        self.__count -= 1
+        return street_number
+
+def populate_town(scale=Scale()):
+    """Give every resident of Git Town an address, returning the town's `Town` registry.
+
+    Raises a `ValueError` if there aren't enough names for all of the town's residents.
+    """
+    everyone = list(sorted(chain(
+        [MAYOR, MAIN_DETECTIVE, ],
+        OTHER_DETECTIVES,
+        SUSPECTS,
+        FACTORY_WORKERS)))
+
+    streets = dict(
+        (street_name, randrange(40 * scale.houses, 200 * scale.houses))
+        for street_name in STREETS)
+    houses = sum(streets.values())
+    town = Town(STREETS, everyone)
+    if town.names_count < houses:
+        raise ValueError(
+            f"There aren't enough names for {houses} residents (only {town.names_count})")
+
+    # Assign "notable" people random addresses. Notice that the street number isn't zero-based.
+    # Picking the n-th free house draws the same random number as picking from a list of them.
+    free_houses = dict(
+        (street_name, FreeHouses(street_length))
+        for (street_name, street_length) in streets.items())
+    notable_residents = dict((street_name, {}) for street_name in streets)
+    street_assignments = choices(list(streets.keys()), k=len(everyone))
+    for (person, street_name) in zip(everyone, street_assignments):
+        street_houses = free_houses[street_name]
+        street_number = street_houses.take(randrange(len(street_houses)))
+        person.set_address(street_name, street_number)
+        notable_residents[street_name][street_number] = person
+
+    # Fill in remaining addresses with random people, no two residents share a name.
+    residents = random_people(everyone)
+    for (street_name, street_length) in streets.items():
+        town.add_street(street_name, street_length, notable_residents[street_name], residents)
+
+    return town
+
+def town_files(town):
+    """Generate the files at the root of the mystery's repository."""
+    inflect = inflect_engine()
+    readme = DATA_DIR.joinpath('README.md').read_text()
+    reference_date = DATE_REPORT_WEEK_START - timedelta(days=2)
+    instructions = DATA_DIR.joinpath('instructions.txt').read_text().format(
+        detective=MAIN_DETECTIVE.name,
+        police_branch=POLICE_BRANCH,
+        reference_date=f'{reference_date:%A, %B} {inflect.ordinal(reference_date.day)}')
+
+    echo('Writing residents file')
+    with StringIO() as residents_csv:
+        writer = DictWriter(
+            residents_csv,
+            fieldnames=('Name', 'Address', ),
+            dialect='excel-tab',
+            lineterminator='\n')
+        writer.writeheader()
+        for resident in town.sorted_by_name():
+            (street_name, street_number) = town.address(resident)
+            writer.writerow({
+                'Name': town.name(resident),
+                'Address': f'{street_number} {street_name}',
+            })
+        residents = residents_csv.getvalue()
+
+    return {
+        'README.md': readme,
+        'instructions.txt': instructions,
+        'residents.txt': residents,
+    }
+
+def build_mystery(repo, town, backend_name='index', phases=(1, 2, 3), solution=True, jobs=1,
+        cache=None, scale=Scale(), report=None, checkpoint=None):
+    """Build the mystery's history into a freshly initialized repository.
+
+    If an `ObjectCache` is given, phases are imported from it when possible. If a `ProfileReport` is
+    given, the town's commit (as part of the setup), each phase and the solution are recorded in it.
+    If a `Checkpoint` is given, the steps it has already done are skipped (it must have been
+    restored first) and each step done from now on is recorded in it.
+    Returns the backend, once it's done writing.
+    """
+    done = set(checkpoint.done) if checkpoint else set()
+    with BACKENDS[backend_name](repo) as backend:
+        if 'setup' not in done:
+            with profile_step(report, 'setup', backend):
+                backend.commit(MAYOR, DATE_START, 'Git Town', files=town_files(town))
+            if checkpoint:
+                checkpoint.record('setup', backend)
+
+        if phases:
+            builders = (
+                lambda: build_phase_1(backend, scale),
+                lambda: build_phase_2(backend, scale),
+                lambda: build_phase_3(backend, town, jobs, scale),
+            )
+            for (i, builder) in enumerate(builders):
+                if i + 1 not in phases:
+                    secho(f'Skipping phase #{i + 1}', fg='cyan')
+                    continue
+                if i + 1 in done:
+                    secho(f'Phase #{i + 1} is already generated', fg='cyan')
+                    continue
+                secho(f'Phase #{i + 1}', fg='magenta')
+                with profile_step(report, f'phase_{i + 1}', backend):
+                    if cache is None:
+                        builder()
+                    else:
+                        with cache.phase(i + 1, backend, town, scale) as cached:
+                            if cached:
+                                echo('Restored from cache')
+                            else:
+                                builder()
+                if checkpoint:
+                    checkpoint.record(i + 1, backend)
+
+        if solution:
+            secho('Encoding the solution', fg='magenta')
+            with profile_step(report, 'solution', backend):
+                build_solution(backend, town)
+
+    return backend
+
+def mystery_manifest(town, backend):
+    """Describe a mystery recorded by the dry-run backend.
+
+    That's every resident's address, the suspects' houses, the murderer and every reference, same
+    as the ones written by a real run. The commits are written along with it by `write_manifest`.
+    """
+    refs = backend.refs
+    # The solution tag points at a blob holding the hash of the murderer's name (see
+    # `build_solution`), it's missing if the solution wasn't generated.
+    murderers = [suspect.name for suspect in SUSPECTS
+        if blob_hash(blob_hash(f'{suspect.name}\n')) == refs.get('refs/tags/solution')]
+    return {
+        'addresses': dict(
+            (street_name, [town.name(resident) for resident in town.street(street_name)])
+            for street_name in town),
+        'suspects': [
+            {'name': suspect.name, 'street': suspect.address[0], 'number': suspect.address[1]}
+            for suspect in SUSPECTS],
+        'murderer': murderers[0] if murderers else None,
+        'refs': refs,
+    }
+
+def write_manifest(manifest_file, town, backend, **fields):
+    """Write the manifest of a mystery recorded by the dry-run backend as JSON, with its commits.
+
+    The commits are written one by one as they're read back from the backend, there can be far too
+    many of them to hold (or to format) all at once.
+    """
+    manifest = dict(fields, **mystery_manifest(town, backend))
+    # Everything else is written as a whole, up to (and without) the object's closing brace.
+    manifest_file.write(json.dumps(manifest, indent=2)[:-2] + ',\n  "commits": [')
+    for (i, commit) in enumerate(backend.commits):
+        manifest_file.write(f'{"," if i else ""}\n    {json.dumps(commit)}')
+    manifest_file.write('\n  ]\n}\n')
+
+def generate_mystery(repo_dir, seed_value, backend_name='index', bare=False, scale=Scale(),
+        store_dir=None):
+    """Generate a whole mystery from a seed, returning a summary of the generated repository.
+
+    If a shared store's directory is given, the mystery's blobs are moved into it (it must have been
+    created already). This is what every process of `generate-batch` runs, and so it's kept
+    picklable.
+    """
+    start = perf_counter()
+    seed(seed_value)
+    town = populate_town(scale)
+    repo = Repo.init(repo_dir, mkdir=True, bare=bare)
+    repo.description = f'A Git Murder Mystery ({seed_value.hex()})'
+    store = SharedStore(store_dir) if store_dir else None
+    if store:
+        store.link(repo)
+    build_mystery(repo, town, backend_name, scale=scale)
+    if store:
+        store.share(repo)
+    return {
+        'seed': seed_value.hex(),
+        # Absolute, so the repositories listed in a manifest are found from any directory.
+        'path': str(Path(repo_dir).resolve()),
+        'refs': dict((ref.path, ref.object.hexsha) for ref in repo.refs),
+        'seconds': round(perf_counter() - start, 3),
+    }
@@ -1,4 +1,4 @@
-PHASES_COUNT = 3
+from ..defines import PHASES_COUNT
 
 from .phase_1 import build_phase_1
 from .phase_2 import build_phase_2
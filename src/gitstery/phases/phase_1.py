@@ -1,15 +1,16 @@
 from itertools import chain
+from datetime import timedelta
 from random import choice
 from click import echo, progressbar
-from inflect import engine
 from ..defines import (DATA_DIR, DATE_END, ACCESS_POINT_OF_INTEREST, DATE_MURDER, DATE_REPORT,
-    DATE_REPORT_WEEK_START, DATE_REPORT_WEEK_END, POLICE_BRANCH)
+    DATE_REPORT_WEEK_START, DATE_REPORT_WEEK_END, POLICE_BRANCH, Scale)
 from ..people import MAIN_DETECTIVE, OTHER_DETECTIVES
+from ..utils import inflect_engine, pipelined
 from ..fillers import random_paragraphs, random_ids, random_datetime, random_datetimes
-from ..git_utils import git_commit, in_branch
+from ..git_utils import in_branch
 
 @in_branch(POLICE_BRANCH)
-def build_phase_1(repo):
+def build_phase_1(backend, scale=Scale()):
     """First phase requiring some history lookup skills.
 
     Finding specific commits in a long history is a common task. It helps answering questions such
@@ -18,26 +19,28 @@ def build_phase_1(repo):
 
     This first step towards the solution will make the player pin down a specific commit in a sea
     of unrelevant "fluff" commits. Leading them to use `git log` with some extra flags.
+
+    The number of "fluff" reports grows with the scale's `reports`, they're generated one at a time.
+    Their texts are prepared by a background thread while the previous reports are being committed.
     """
     all_detectives = OTHER_DETECTIVES + [MAIN_DETECTIVE, ]
-    report_ids = random_ids()
+    report_ids = random_ids(scale.reports)
 
     # Commit some reports before the main one, making sure the ones on the same week aren't
     # from the main detective.
-    reports_before = 84
+    reports_before = 84 * scale.reports
     dates = chain(
         zip((choice(all_detectives) for _ in range(reports_before - 1)),
             random_datetimes(reports_before - 1, DATE_REPORT_WEEK_START, hour_max=23)),
         zip((choice(OTHER_DETECTIVES) for _ in range(1)),
             random_datetimes(1, DATE_REPORT_WEEK_START, DATE_REPORT, hour_max=23)))
-    with progressbar(dates, length=reports_before, label='Comitting scene report before') as bar:
-        for (detective, date) in bar:
-            git_commit(repo, detective, date,
-                f'Crime scene report #{next(report_ids)}',
-                random_paragraphs())
+    with progressbar(pipelined(fluff_reports(dates, report_ids)), length=reports_before,
+            label='Comitting scene report before') as bar:
+        for (detective, date, title, body) in bar:
+            backend.commit(detective, date, title, body)
 
     echo('Committing the main crime scene report')
-    inflect = engine()
+    inflect = inflect_engine()
     days_since_murder = DATE_REPORT - DATE_MURDER
     murder_time_min = random_datetime(
         DATE_MURDER, DATE_MURDER, hour_min=DATE_MURDER.hour - 2, hour_max=DATE_MURDER.hour - 1)
@@ -54,20 +57,25 @@ def build_phase_1(repo):
         murder_time_max=f'{murder_time_max:%H:%M}',
         detective_branch=f'detectives/{MAIN_DETECTIVE.username}',
         access_point=ACCESS_POINT_OF_INTEREST)
-    git_commit(repo, MAIN_DETECTIVE, DATE_REPORT,
+    backend.commit(MAIN_DETECTIVE, DATE_REPORT,
         f'Crime scene report #{next(report_ids)}',
         main_report)
 
-    # Commit some reports after the main one, making sure the ones on the same week aren't
-    # from the main detective.
-    reports_after = 92
+    # Commit some reports after the main one, making sure the ones on the same week (including its
+    # last day) aren't from the main detective.
+    reports_after = 92 * scale.reports
     dates = chain(
         zip((choice(OTHER_DETECTIVES) for _ in range(2)),
             random_datetimes(2, DATE_REPORT, DATE_REPORT_WEEK_END, hour_max=23)),
         zip((choice(all_detectives) for _ in range(reports_after - 2)),
-            random_datetimes(reports_after - 2, DATE_REPORT_WEEK_END, DATE_END, hour_max=23)))
-    with progressbar(dates, length=reports_after, label='Comitting scene report after') as bar:
-        for (detective, date) in bar:
-            git_commit(repo, detective, date,
-                f'Crime scene report #{next(report_ids)}',
-                random_paragraphs())
+            random_datetimes(reports_after - 2, DATE_REPORT_WEEK_END + timedelta(days=1), DATE_END,
+                hour_max=23)))
+    with progressbar(pipelined(fluff_reports(dates, report_ids)), length=reports_after,
+            label='Comitting scene report after') as bar:
+        for (detective, date, title, body) in bar:
+            backend.commit(detective, date, title, body)
+
+def fluff_reports(dates, report_ids):
+    """Generate the author, date, title and text of each "fluff" report."""
+    for (detective, date) in dates:
+        yield (detective, date, f'Crime scene report #{next(report_ids)}', random_paragraphs())
@@ -1,15 +1,16 @@
 from itertools import chain
 from random import choice, randrange
-from pathlib import Path
 from datetime import timedelta
+from io import StringIO
 from click import progressbar
-from ..defines import MURDER_DAY, ACCESS_POINT_OF_INTEREST
+from ..defines import MURDER_DAY, ACCESS_POINT_OF_INTEREST, Scale
 from ..people import MAIN_DETECTIVE, SUSPECTS, FACTORY_WORKERS
 from ..fillers import random_datetimes
-from ..git_utils import git_commit, in_branch
+from ..utils import pipelined
+from ..git_utils import in_branch
 
 @in_branch(f'detectives/{MAIN_DETECTIVE.username}')
-def build_phase_2(repo):
+def build_phase_2(backend, scale=Scale()):
     """Second phase requiring some codebase search skills.
 
     Sometimes we want to search a specific string in the codebase. We can do so using `grep`, `ack`
@@ -18,11 +19,10 @@ def build_phase_2(repo):
     we can use `git blame` or `git log -S`.
 
     To solve the second step, the player will have to match a line in a file to a commit author.
-    """
-    evidence_dir = Path(repo.working_tree_dir) / 'evidence'
-    evidence_dir.mkdir()
-    access_log = evidence_dir / 'access.log'
 
+    The number of other workers' entries grows with the scale's `access_logs`. The log's contents are
+    prepared by a background thread while the previous entries are being committed.
+    """
     # We commit each suspect's entry in reverse so that `git log` will lead first to the first
     # suspect's interview on the next step.
     (entry_1, entry_2, entry_3, ) = reversed(SUSPECTS)
@@ -31,7 +31,7 @@ def build_phase_2(repo):
         'BACK_ROOM_231', 'SECURITY_ROOM_1', 'SECURITY_ROOM_2', 'PRINTER_ROOM_76',
     )
 
-    chunks = (randrange(5, 20), randrange(5, 20), randrange(5, 20), randrange(5, 20))
+    chunks = tuple(randrange(5 * scale.access_logs, 20 * scale.access_logs) for _ in range(4))
     logs = zip(
         chain((choice(FACTORY_WORKERS) for _ in range(chunks[0])),
               [entry_1, ],
@@ -48,10 +48,17 @@ def build_phase_2(repo):
               [ACCESS_POINT_OF_INTEREST, ],
               (choice(access_points) for _ in range(chunks[3]))),
         random_datetimes(sum(chunks), MURDER_DAY, MURDER_DAY + timedelta(days=1), hour_max=18))
-    with progressbar(logs, length=sum(chunks) + len(SUSPECTS),
+    with progressbar(pipelined(access_log_entries(logs)), length=sum(chunks) + len(SUSPECTS),
             label='Comitting factory access logs') as bar:
-        for (worker, access_point, time) in bar:
-            with access_log.open('a') as l:
-                l.write(f'{access_point}\n')
-            repo.index.add(access_log.as_posix())
-            git_commit(repo, worker, time, f'ACCESS LOG COMMIT {time:%H:%M}')
+        for (worker, time, access_log) in bar:
+            backend.commit(worker, time, f'ACCESS LOG COMMIT {time:%H:%M}',
+                files={'evidence/access.log': access_log})
+
+def access_log_entries(logs):
+    """Generate the worker, time and the whole access log's contents after each of its entries."""
+    # The log is only ever appended to, so we keep it in memory rather than reopening the file for
+    # every entry.
+    access_log = StringIO()
+    for (worker, access_point, time) in logs:
+        access_log.write(f'{access_point}\n')
+        yield (worker, time, access_log.getvalue())
@@ -1,13 +1,12 @@
-from pathlib import Path
 from datetime import timedelta
-from tempfile import NamedTemporaryFile
+from concurrent.futures import ProcessPoolExecutor
 from click import echo, progressbar
-from git import Blob
-from ..defines import DATA_DIR, DATE_START, DATE_MURDER
+from git import Repo, Blob, Commit, Tree
+from ..defines import DATA_DIR, DATE_START, DATE_MURDER, Scale
 from ..people import MAYOR, SUSPECTS
-from ..utils import wrap_paragraphs
+from ..utils import wrap_paragraphs, pipelined
 from ..fillers import random_paragraphs, random_ids
-from ..git_utils import git_commit, restore_head
+from ..git_utils import tree_object, commit_object, commit_message, object_hash, PackWriter
 
 COMMIT_MSG_INVESTIGATIONS = """\
 This branch holds investigations.
@@ -15,7 +14,7 @@ This branch holds investigations.
 You could *try* sifting through it, but it's probably better to know what you're looking for.
 """
 
-def build_phase_3(repo, addresses):
+def build_phase_3(backend, town, jobs=1, scale=Scale()):
     """Third phase which requires some "big repository" search skills.
 
     Sometimes we know how to reference a certain commit and would like to see its message or
@@ -30,72 +29,121 @@ def build_phase_3(repo, addresses):
     The third step in the mystery will lead to player to both reference a given commit as the N-th
     parent of a known reference, and also display its contents and message using `git show`. The
     fourth step will use hashes to show that any type of reference can be provided to `git show`.
+
+    Each street is an independent chain of commits, so with more than one job the streets' commits
+    are written concurrently by a pool of processes. The texts are still drawn here, in order, so
+    the result is the same regardless of the number of jobs. With a single job they're prepared by a
+    background thread while the previous houses are being committed.
     """
-    eyewitness_time = DATE_MURDER - timedelta(hours=1)
-    blob_ids = random_ids()
-    blobs = []
-    commit_investigation_path = Path(repo.working_tree_dir) / 'investigate'
-    for (street_name, street_residents) in addresses.items():
-        with restore_head(repo):
+    blob_ids = random_ids(scale.houses)
+    blobs = {}
+    if 1 == jobs:
+        for street_name in town:
             # Detach head from current commit. We want only the tag to lead to the "house" commits.
-            repo.head.reference = repo.commit('HEAD')
-            assert repo.head.is_detached
-
-            # Iterate in reverse so that house number N will be the tag's N-th parent.
-            # The `+1` is because we also count the creation of the tag.
-            with progressbar(length=len(street_residents) + 1,
-                    label=f'Generating street commits: {street_name}') as bar:
-                for (i, person) in enumerate(reversed(street_residents)):
-                    if person in SUSPECTS:
-                        suspect_index = SUSPECTS.index(person) + 1
-                        interview_path = DATA_DIR / f'interview-{suspect_index}.txt'
-                        interview = interview_path.read_text()
-                        investigation_path = DATA_DIR / f'investigation-{suspect_index}.txt'
-                        investigation = investigation_path.read_text().format(
-                            eyewitness_time=f'{eyewitness_time:%I%p}'.lstrip('0'))
-                    else:
-                        interview = random_paragraphs()
-                        investigation = random_paragraphs()
-
-                    # We generate a new blob to be added to the 'investigations' branch later on.
-                    # We have to have the contents under an actual reference, otherwise they won't
-                    # be cloned along with the repository by the player.
-                    with NamedTemporaryFile('w') as investigation_file:
-                        investigation_file.write(wrap_paragraphs(investigation))
-                        investigation_file.flush()
-                        blobs.append(Blob(
-                            repo,
-                            bytes.fromhex(repo.git.hash_object('-w', investigation_file.name)),
-                            mode=Blob.file_mode,
-                            path=str(next(blob_ids))))
-
-                    commit_investigation_path.write_text(blobs[-1].hexsha)
-                    repo.index.add(commit_investigation_path.as_posix())
-
-                    git_commit(repo, MAYOR, DATE_START,
-                        f'{len(street_residents) - i} {street_name}',
-                        interview)
+            with backend.detached():
+                # The `+1` is because we also count the creation of the tag.
+                with progressbar(length=len(town.street(street_name)) + 1,
+                        label=f'Generating street commits: {street_name}') as bar:
+                    for (title, interview, investigation, blob_id) in pipelined(street_houses(
+                            town, street_name, blob_ids)):
+                        # We generate a new blob to be added to the 'investigations' branch later
+                        # on. We have to have the contents under an actual reference, otherwise
+                        # they won't be cloned along with the repository by the player.
+                        blobs[blob_id] = backend.blob(investigation)
+                        backend.commit(MAYOR, DATE_START, title, interview,
+                            files={'investigate': blobs[blob_id]})
+                        bar.update(1)
+
+                    # Create the tag to the "beginning" of the street.
+                    backend.commit(MAYOR, DATE_START, f'{street_name}')
+                    backend.tag(street_tag(street_name))
                     bar.update(1)
 
-                # Create the tag to the "beginning" of the street.
-                git_commit(repo, MAYOR, DATE_START, f'{street_name}')
-                street_tag_name = street_name.lower().replace(' ', '_')
-                repo.create_tag(f'street/{street_tag_name}')
-                bar.update(1)
+            echo_suspects(street_name)
+    else:
+        # The street chains are all rooted at the current commit, which the workers will need to
+        # find in the object database.
+        base = Commit(backend.repo, bytes.fromhex(backend.checkpoint()))
+        base_entries = [(item.mode, item.name, item.binsha) for item in base.tree]
+        git_dir = backend.repo.git_dir
+        with ProcessPoolExecutor(jobs) as pool:
+            streets = []
+            for street_name in town:
+                houses = list(street_houses(town, street_name, blob_ids))
+                streets.append((street_name, pool.submit(build_street,
+                    git_dir, base.hexsha, base_entries, street_name, houses)))
+
+            with progressbar(streets, label='Generating street commits') as bar:
+                for (street_name, street) in bar:
+                    (tip, street_blobs) = street.result()
+                    blobs.update(street_blobs)
+                    backend.tag(street_tag(street_name), ref=tip)
 
-            for (i, suspect) in enumerate(SUSPECTS):
-                if suspect in street_residents:
-                    house_number = street_residents.index(suspect) + 1
-                    echo(f'  Suspect #{i + 1} lives at #{house_number}')
+        for (street_name, _) in streets:
+            echo(f'  {street_name}')
+            echo_suspects(street_name)
 
     # Create a new branch, not connected to the repository's root, which will hold the
     # investigations texts' commits. If we don't place those commits somewhere addressable, when
     # the player `git clone`-s the repository they won't get them and cannot solve the mystery.
     echo('Creating the investigations branch')
-    with restore_head(repo):
-        repo.git.checkout('--orphan', 'investigations')
-        repo.index.remove('*', force=True, working_tree=True)
-        repo.index.add(blobs)
-        git_commit(repo, MAYOR, DATE_START,
+    with backend.orphan('investigations'):
+        backend.commit(MAYOR, DATE_START,
             'Investigations',
-            COMMIT_MSG_INVESTIGATIONS)
+            COMMIT_MSG_INVESTIGATIONS,
+            blobs=blobs)
+
+def street_tag(street_name):
+    street_tag_name = street_name.lower().replace(' ', '_')
+    return f'street/{street_tag_name}'
+
+def street_houses(town, street_name, blob_ids):
+    """Generate the title, interview, investigation and investigation ID of each house commit.
+
+    Houses are generated in reverse so that house number N will be the tag's N-th parent.
+    """
+    eyewitness_time = DATE_MURDER - timedelta(hours=1)
+    suspects = dict((town.find(suspect), i + 1) for (i, suspect) in enumerate(SUSPECTS))
+    for resident in reversed(town.street(street_name)):
+        suspect_index = suspects.get(resident)
+        if suspect_index:
+            interview_path = DATA_DIR / f'interview-{suspect_index}.txt'
+            interview = interview_path.read_text()
+            investigation_path = DATA_DIR / f'investigation-{suspect_index}.txt'
+            investigation = investigation_path.read_text().format(
+                eyewitness_time=f'{eyewitness_time:%I%p}'.lstrip('0'))
+        else:
+            interview = random_paragraphs()
+            investigation = random_paragraphs()
+
+        yield (f'{town.address(resident)[1]} {street_name}',
+            interview,
+            wrap_paragraphs(investigation),
+            str(next(blob_ids)))
+
+def build_street(git_dir, base, base_entries, street_name, houses):
+    """Write a street's commits into a pack, returning the street's tip and its blobs."""
+    blobs = {}
+    parent = base
+    # The base commit's tree is already in the repository.
+    tree = object_hash(Tree.type, tree_object(base_entries))
+    with PackWriter(Repo(git_dir)) as pack:
+        for (title, interview, investigation, blob_id) in houses:
+            blobs[blob_id] = pack.store(Blob.type, investigation.encode())
+            investigate = pack.store(Blob.type, blobs[blob_id].encode())
+            tree = pack.store(Tree.type, tree_object(
+                [entry for entry in base_entries if 'investigate' != entry[1]]
+                + [(Blob.file_mode, 'investigate', bytes.fromhex(investigate))]))
+            parent = pack.store(Commit.type, commit_object(
+                tree, [parent], MAYOR, DATE_START, commit_message(title, interview)))
+
+        # The tag's commit doesn't change the tree, same as the last house's commit.
+        tip = pack.store(Commit.type, commit_object(
+            tree, [parent], MAYOR, DATE_START, street_name))
+    return (tip, blobs)
+
+def echo_suspects(street_name):
+    for (i, suspect) in enumerate(SUSPECTS):
+        (suspect_street, house_number) = suspect.address
+        if street_name == suspect_street:
+            echo(f'  Suspect #{i + 1} lives at #{house_number}')
@@ -0,0 +1,128 @@
+import json
+from os import times, walk
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from cProfile import Profile
+
+class ProfileReport():
+    """Instrument the steps of a mystery's generation (the setup, each phase and the solution).
+
+    For each step we record its wall and CPU time, the number of git processes spawned through
+    GitPython, the number of commits and objects written to the repository, the number of bytes the
+    object database grew by and the process' peak RSS. Steps entered more than once (like the
+    setup, which begins before the repository is even created) are accumulated.
+
+    If a profiles directory is given, a cProfile dump of each step is written to it as well.
+    """
+    def __init__(self, profile_dir=None):
+        self.__steps = {}
+        self.__profiles = {}
+        self.__profile_dir = Path(profile_dir) if profile_dir else None
+        if self.__profile_dir:
+            self.__profile_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def step(self, name, backend=None):
+        """Record a step, the objects it writes are only counted if it's given the backend."""
+        (objects_before, size_before) = _object_database(backend) if backend else (Counter(), 0)
+        profile = self.__profiles.setdefault(name, Profile()) if self.__profile_dir else None
+        _reset_peak_rss()
+        times_before = times()
+        start = perf_counter()
+        with _count_git_processes() as git_processes:
+            if profile:
+                profile.enable()
+            try:
+                yield
+                if backend:
+                    # Objects written by `fast-import` are only in the object database after a
+                    # checkpoint, which also makes the step wait for them to be written.
+                    backend.checkpoint()
+            finally:
+                if profile:
+                    profile.disable()
+        wall_seconds = perf_counter() - start
+        times_after = times()
+        peak_rss = _peak_rss()
+
+        (objects, size) = _object_database(backend) if backend else (Counter(), 0)
+        objects.subtract(objects_before)
+
+        step = self.__steps.setdefault(name, Counter())
+        step.update({
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': (times_after.user + times_after.system)
+                - (times_before.user + times_before.system),
+            'children_cpu_seconds': (times_after.children_user + times_after.children_system)
+                - (times_before.children_user + times_before.children_system),
+            'git_processes': git_processes[0],
+            'commits': objects['commit'],
+            'objects': sum(objects.values()),
+            'bytes_written': size - size_before,
+        })
+        step['peak_rss'] = max(step['peak_rss'], peak_rss)
+
+        if profile:
+            # The dump holds every time the step was entered so far.
+            profile.dump_stats(self.__profile_dir / f'{name}.prof')
+
+    def write(self, path, **details):
+        """Write the report as JSON, along with any other details of the generation."""
+        Path(path).write_text(json.dumps(dict(details, steps=dict(
+            (name, dict((key, round(value, 3)) for (key, value) in step.items()))
+            for (name, step) in self.__steps.items())), indent=2))
+
+def profile_step(report, name, backend=None):
+    """Record a step in the report, if there is one."""
+    return report.step(name, backend) if report else nullcontext()
+
+@contextmanager
+def _count_git_processes():
+    # Every git command GitPython runs (including its persistent `cat-file` processes) goes through
+    # `Git.execute`, so we count the calls to it. It's a list so it could be read once we're done.
+    from git.cmd import Git
+    execute = Git.execute
+    calls = [0, ]
+
+    def _counting_execute(*args, **kwargs):
+        calls[0] += 1
+        return execute(*args, **kwargs)
+
+    Git.execute = _counting_execute
+    try:
+        yield calls
+    finally:
+        Git.execute = execute
+
+def _object_database(backend):
+    """Count the objects in the repository's database by type, and measure its size in bytes."""
+    objects = Counter(backend.repo.git.cat_file(
+        '--batch-all-objects', '--batch-check=%(objecttype)').split())
+    size = sum(
+        sum(Path(root, file_name).stat().st_size for file_name in file_names)
+        for (root, _, file_names) in walk(Path(backend.repo.git_dir) / 'objects'))
+    return (objects, size)
+
+def _reset_peak_rss():
+    # Only Linux allows resetting the peak RSS, elsewhere it's the peak of the whole process so far.
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+    except OSError:
+        pass
+
+def _peak_rss():
+    """The process' peak RSS in bytes, or zero if it can't be measured."""
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        from resource import getrusage, RUSAGE_SELF
+    except ImportError:
+        return 0
+    # Linux has the status file, so we only get here on systems (like macOS) where it's in bytes.
+    return getrusage(RUSAGE_SELF).ru_maxrss
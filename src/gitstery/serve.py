@@ -0,0 +1,274 @@
+import json
+from os import urandom, utime
+from pathlib import Path
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from shutil import rmtree, copyfileobj
+from threading import Lock, Timer
+from time import perf_counter, time
+from click import secho
+from git import Repo
+from .defines import Scale, SERVED_MAX_AGE_MINUTES, SERVED_MAX_COUNT
+from .git_utils import export_bundle
+from .mystery import generate_mystery
+
+# How many of the latest requests and generations the metrics are computed over.
+METRICS_WINDOW = 1000
+# After a generation fails the pool is only refilled after a delay, doubled with every consecutive
+# failure up to a maximum, so a persistent failure doesn't keep the processes busy failing.
+RETRY_DELAY_SECONDS = 1
+MAX_RETRY_DELAY_SECONDS = 60
+
+def prepare_mystery(pending_dir, seed_value, backend_name, scale):
+    """Generate a mystery and export its bundle into the pool's pending directory.
+
+    This is what the pool's processes run, and so it's kept picklable.
+    """
+    start = perf_counter()
+    repo_dir = Path(pending_dir) / seed_value.hex()
+    mystery = generate_mystery(repo_dir, seed_value, backend_name, scale=scale)
+    export_bundle(Repo(repo_dir), repo_dir.with_suffix('.bundle'))
+    return dict(mystery, seconds=round(perf_counter() - start, 3))
+
+class MysteryPool():
+    """A pool of mysteries generated ahead of time, refilled by a pool of processes.
+
+    The pool's directory holds the mysteries still being generated under `pending`, the ones ready
+    to be served under `ready` (each a repository and a bundle named after its seed) and the ones
+    served as paths under `served`. Mysteries which were ready when the pool was last stopped are
+    served first. Failed generations are reported to the standard error and retried after a delay.
+
+    Served mysteries are deleted once they're older than `served_max_age` minutes, or when there are
+    more than `served_max_count` of them, whenever the pool is refilled or another one is served and
+    when it's opened.
+    """
+    def __init__(self, pool_dir, size, jobs, backend_name='fast-import', scale=Scale(),
+            initializer=None, served_max_age=SERVED_MAX_AGE_MINUTES,
+            served_max_count=SERVED_MAX_COUNT):
+        # The mysteries' repositories and bundles are written by git, running in each repository.
+        self.__pool_dir = Path(pool_dir).resolve()
+        self.__size = size
+        self.__backend_name = backend_name
+        self.__scale = scale
+        self.__served_max_age = served_max_age * 60
+        self.__served_max_count = served_max_count
+        self.__lock = Lock()
+        # Requests refill the pool concurrently, but only one of them deletes the expired mysteries.
+        self.__expire_lock = Lock()
+        self.__generating = 0
+        self.__served = 0
+        self.__misses = 0
+        self.__failures = 0
+        self.__consecutive_failures = 0
+        self.__retry_timer = None
+        self.__closed = False
+        self.__generation_seconds = deque(maxlen=METRICS_WINDOW)
+        self.__request_seconds = deque(maxlen=METRICS_WINDOW)
+
+        # Anything left pending was interrupted while being generated.
+        rmtree(self.__pool_dir / 'pending', ignore_errors=True)
+        for name in ('pending', 'ready', 'served'):
+            (self.__pool_dir / name).mkdir(parents=True, exist_ok=True)
+        self.__ready = deque(sorted(
+            (path for path in (self.__pool_dir / 'ready').iterdir()
+                if path.is_dir() and path.with_suffix('.bundle').is_file()),
+            key=lambda path: path.stat().st_mtime))
+        self.__expire_served()
+
+        self.__executor = ProcessPoolExecutor(jobs, initializer=initializer)
+        self.__refill()
+
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            if self.__retry_timer:
+                self.__retry_timer.cancel()
+        self.__executor.shutdown(cancel_futures=True)
+
+    def take(self):
+        """Take a ready mystery out of the pool, returning its repository's path (or `None`)."""
+        with self.__lock:
+            repo_dir = self.__ready.popleft() if self.__ready else None
+            if repo_dir:
+                self.__served += 1
+            else:
+                self.__misses += 1
+        self.__refill()
+        return repo_dir
+
+    def serve_path(self, repo_dir):
+        """Move a mystery taken from the pool to where it's served from, dropping its bundle."""
+        served_dir = self.__pool_dir / 'served' / repo_dir.name
+        repo_dir.with_suffix('.bundle').unlink()
+        repo_dir.rename(served_dir)
+        # A served mystery's age is counted from when it was served, not generated.
+        utime(served_dir)
+        self.__expire_served(keep=served_dir)
+        return served_dir
+
+    def discard(self, repo_dir):
+        """Delete a mystery taken from the pool, once its bundle was served."""
+        repo_dir.with_suffix('.bundle').unlink()
+        rmtree(repo_dir)
+
+    def record_request(self, seconds):
+        with self.__lock:
+            self.__request_seconds.append(seconds)
+
+    def metrics(self):
+        with self.__lock:
+            return {
+                'pool': {
+                    'size': self.__size,
+                    'ready': len(self.__ready),
+                    'generating': self.__generating,
+                },
+                'served': self.__served,
+                'misses': self.__misses,
+                'failures': self.__failures,
+                'request_seconds': _summary(self.__request_seconds),
+                'generation_seconds': _summary(self.__generation_seconds),
+            }
+
+    def __expire_served(self, keep=None):
+        with self.__expire_lock:
+            served = sorted((path.stat().st_mtime, path)
+                for path in (self.__pool_dir / 'served').iterdir()
+                if path.is_dir() and path != keep)
+            expired = time() - self.__served_max_age
+            # The mystery being kept still counts towards the maximum, it's just never the oldest.
+            excess = len(served) + bool(keep) - self.__served_max_count
+            for (index, (mtime, path)) in enumerate(served):
+                if index < excess or mtime < expired:
+                    rmtree(path)
+
+    def __refill(self):
+        self.__expire_served()
+        with self.__lock:
+            # While waiting to retry a failed generation, the retry refills the pool.
+            if self.__closed or self.__retry_timer:
+                return
+            missing = self.__size - len(self.__ready) - self.__generating
+            self.__generating += max(missing, 0)
+        for _ in range(missing):
+            seed_value = urandom(10)
+            future = self.__executor.submit(prepare_mystery, self.__pool_dir / 'pending',
+                seed_value, self.__backend_name, self.__scale)
+            future.add_done_callback(partial(self.__prepared, seed_value))
+
+    def __retry(self):
+        with self.__lock:
+            self.__retry_timer = None
+        self.__refill()
+
+    def __prepared(self, seed_value, future):
+        if future.cancelled():
+            return
+        ready_dir = None
+        try:
+            mystery = future.result()
+            # Both the repository and its bundle are moved, the repository last since it's the one
+            # looked for when the pool is started again.
+            pending_dir = Path(mystery['path'])
+            moved_dir = self.__pool_dir / 'ready' / pending_dir.name
+            pending_dir.with_suffix('.bundle').rename(moved_dir.with_suffix('.bundle'))
+            pending_dir.rename(moved_dir)
+            ready_dir = moved_dir
+        except Exception as err:
+            secho(f'{seed_value.hex()}: Failed to generate ({err})', fg='red', err=True)
+            for name in ('pending', 'ready'):
+                path = self.__pool_dir / name / seed_value.hex()
+                rmtree(path, ignore_errors=True)
+                path.with_suffix('.bundle').unlink(missing_ok=True)
+        finally:
+            # The counters are updated however the generation ended, or the pool is never refilled.
+            with self.__lock:
+                self.__generating -= 1
+                if ready_dir:
+                    self.__consecutive_failures = 0
+                    self.__ready.append(ready_dir)
+                    self.__generation_seconds.append(mystery['seconds'])
+                else:
+                    self.__failures += 1
+                    self.__consecutive_failures += 1
+                    if not (self.__closed or self.__retry_timer):
+                        delay = min(RETRY_DELAY_SECONDS * 2 ** (self.__consecutive_failures - 1),
+                            MAX_RETRY_DELAY_SECONDS)
+                        self.__retry_timer = Timer(delay, self.__retry)
+                        self.__retry_timer.daemon = True
+                        self.__retry_timer.start()
+
+def _summary(seconds):
+    if not seconds:
+        return {'count': 0}
+    ordered = sorted(seconds)
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 6),
+        'p50': round(ordered[len(ordered) // 2], 6),
+        'p95': round(ordered[min(len(ordered) - 1, len(ordered) * 95 // 100)], 6),
+        'max': round(ordered[-1], 6),
+    }
+
+class MysteryRequestHandler(BaseHTTPRequestHandler):
+    """Serve mysteries from the server's pool.
+
+    * `GET /mystery` takes a mystery, answering with its seed and repository's path as JSON.
+    * `GET /mystery.bundle` takes a mystery, answering with its bundle.
+    * `GET /metrics` answers with the pool's depth and the requests' and generations' latencies.
+
+    When the pool is empty the request is answered right away with a 503.
+    """
+    def do_GET(self):
+        start = perf_counter()
+        if '/metrics' == self.path:
+            self.__send_json(200, self.server.pool.metrics())
+            return
+
+        if self.path not in ('/mystery', '/mystery.bundle'):
+            self.__send_json(404, {'error': f'No such resource: {self.path}'})
+            return
+
+        pool = self.server.pool
+        repo_dir = pool.take()
+        if repo_dir is None:
+            self.__send_json(503, {'error': 'No mystery is ready, try again later'},
+                {'Retry-After': '1'})
+        elif '/mystery' == self.path:
+            served_dir = pool.serve_path(repo_dir)
+            self.__send_json(200, {'seed': served_dir.name, 'path': str(served_dir)})
+        else:
+            bundle_path = repo_dir.with_suffix('.bundle')
+            # The mystery was already taken out of the pool, it's deleted even if the client went
+            # away before getting all of it.
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(bundle_path.stat().st_size))
+                self.send_header('Content-Disposition',
+                    f'attachment; filename="{bundle_path.name}"')
+                self.end_headers()
+                with bundle_path.open('rb') as bundle:
+                    copyfileobj(bundle, self.wfile)
+            finally:
+                pool.discard(repo_dir)
+        pool.record_request(perf_counter() - start)
+
+    def __send_json(self, status, body, headers=None):
+        data = json.dumps(body, indent=2).encode() + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class MysteryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pool):
+        super().__init__(address, MysteryRequestHandler)
+        self.pool = pool
@@ -1,39 +1,32 @@
-import re
-from datetime import datetime
-from subprocess import check_output
-from pathlib import Path
-from tempfile import NamedTemporaryFile
+from datetime import datetime, timedelta, timezone
+from calendar import timegm
 from click import echo, secho
 from .defines import (DATE_REPORT, DATE_REPORT_WEEK_START, DATE_REPORT_WEEK_END, POLICE_BRANCH,
     ACCESS_POINT_OF_INTEREST)
 from .people import MAIN_DETECTIVE, SUSPECTS
 from .utils import rot13
+from .git_utils import TREE_MODE, blob_hash, ObjectReader
 
-def build_solution(repo, addresses):
+def build_solution(backend, town):
     # First we generate a hash for the solution to store as the contents of the `solution` tag.
     # We append a newline to the murderer's name because the check will use `echo` that appends it
     # as well. We don't actually write the object so its contents won't appear in the repository.
     # The index to the real murderer is obfuscated to not give it away in the source code :)
-    murderer = SUSPECTS[sum(int(t, int(str(sum(len(t) for t in addresses) // 10 - 1), 16)) for t in map(''.join, zip('zip', 'join'))) & ord('T') % ord('-') % ord('$')]
-    with NamedTemporaryFile('w') as solution:
-        solution.write(murderer.name + '\n')
-        solution.flush()
-        solution_hash = repo.git.hash_object(solution.name)
+    murderer = SUSPECTS[sum(int(t, int(str(sum(len(t) for t in town) // 10 - 1), 16)) for t in map(''.join, zip('zip', 'join'))) & ord('T') % ord('-') % ord('$')]
+    solution_hash = blob_hash(murderer.name + '\n')
 
     # We encode the solution as a new data object and tag it. That way it won't appear in the
     # repository's filesystem or git log, but can still be addressable.
-    with NamedTemporaryFile('w') as solution:
-        solution.write(solution_hash)
-        solution.flush()
-        solution_ref = repo.git.hash_object('-w', solution.name)
-
-    repo.create_tag('solution', ref=solution_ref)
+    solution_ref = backend.blob(solution_hash)
+    backend.tag('solution', ref=solution_ref)
 
 def verify_repository(repo):
     ###  NOTE - SPOILER ALERT!!!!
     # This function is used to verify the repository generated during development. If you haven't
     # solved the mystery yet, don't spoil the way to the solution for yourself by reading it.
-    repo_root = Path(repo.working_tree_dir)
+    #
+    # All objects are read through a single `git cat-file` process, and the files are read from the
+    # current commit rather than the working tree (they're the same in a clean repository).
     try:
         (police_branch, ) = (branch for branch in repo.refs if branch.name.endswith(POLICE_BRANCH))
     except ValueError as err:
@@ -47,82 +40,82 @@ def verify_repository(repo):
         echo(f"Missing main detective's branch: {err}")
         return False
 
-    if not repo_root.joinpath('README.md').exists():
+    with ObjectReader(repo) as reader:
+        return _verify_repository(reader, police_branch.path, detective_branch.path)
+
+def _verify_repository(reader, police_branch, detective_branch):
+    files = reader.tree('HEAD^{tree}')
+    if 'README.md' not in files:
         echo("Can't find 'README.md'")
         return False
-    instructions = repo_root / 'instructions.txt'
-    if not instructions.exists():
-        echo(f"Can't find '{instructions.name}'")
+    if 'instructions.txt' not in files:
+        echo("Can't find 'instructions.txt'")
         return False
-    instructions_text = instructions.read_text()
+    instructions_text = reader.text('HEAD:instructions.txt')
     if MAIN_DETECTIVE.name not in instructions_text:
-        echo(f"The main detective's name ({MAIN_DETECTIVE.name}) isn't in '{instructions.name}'")
+        echo(f"The main detective's name ({MAIN_DETECTIVE.name}) isn't in 'instructions.txt'")
         return False
     elif POLICE_BRANCH not in instructions_text:
-        echo(f"The policy branch name ({POLICE_BRANCH}) isn't in '{instructions.name}'")
+        echo(f"The policy branch name ({POLICE_BRANCH}) isn't in 'instructions.txt'")
         return False
 
     secho('Finding main report commit', fg='magenta')
-    regex_commit_log = re.compile('\n'.join([
-        r'commit [0-9a-f]+',
-        r'Author: +(.+) <.+>',
-        r'Date: +(.+)',
-        r'',
-        r'(.*)(?:\n((?: +.*\n*)+))?',
-    ]), re.MULTILINE)
-    commits = regex_commit_log.findall(repo.git.log(
-        '--since', f'{DATE_REPORT_WEEK_START:%d/%m/%Y}',
-        '--before', f'{DATE_REPORT_WEEK_END:%d/%m/%Y}',
-        '--author', f'{MAIN_DETECTIVE.name}',
-        police_branch))
+    # Same as `git log --since=<week start> --before=<week end> --author=<main detective>`, which
+    # also stops walking the (chronological) history once it's past the week's start.
+    (week_start, week_end) = (
+        timegm(DATE_REPORT_WEEK_START.timetuple()),
+        timegm((DATE_REPORT_WEEK_END + timedelta(days=1)).timetuple()))
+    commits = []
+    for commit in reader.history(police_branch):
+        if commit.committed_date < week_start:
+            break
+        if commit.committed_date < week_end and MAIN_DETECTIVE.name == commit.author:
+            commits.append(commit)
     if not commits:
         echo('No commits match for main report')
         return False
     elif 1 < len(commits):
         echo(f'Multiple commits ({len(commits)}) match main report')
         return False
-    ((author, timestamp, title, main_report, ), ) = commits
-    timestamp = datetime.strptime(timestamp, '%a %b %d %H:%M:%S %Y %z').replace(tzinfo=None)
-    assert MAIN_DETECTIVE.name == author
-    assert 'Crime scene report' in title
-    assert DATE_REPORT == timestamp
+    ((_, _, _, _, timestamp, _, main_report), ) = commits
+    assert main_report.startswith('Crime scene report')
+    assert DATE_REPORT == datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
     assert ACCESS_POINT_OF_INTEREST in main_report
     assert f'detectives/{MAIN_DETECTIVE.username}' in main_report
 
     secho('Finding suspects in access log', fg='magenta')
-    commits = regex_commit_log.findall(repo.git.log(
-        f'-S{ACCESS_POINT_OF_INTEREST}',
-        detective_branch))
+    commits = list(_pickaxe(reader, detective_branch, ACCESS_POINT_OF_INTEREST))
     if not len(SUSPECTS) == len(commits):
         echo(f'Expected number {len(SUSPECTS)} commits, got {len(commits)}')
         return False
-    suspect_names = set(author for (author, _, _, _) in commits)
+    suspect_names = set(commit.author for commit in commits)
     current_suspects = set(s.name for s in SUSPECTS)
     assert current_suspects == suspect_names
 
     secho("Finding suspects' addresses", fg='magenta')
+    # Same as `git grep -w <suspect> -- residents.txt`, for each suspect.
+    residents = dict(
+        line.split('\t', 1) for line in reader.text('HEAD:residents.txt').splitlines()[1:])
     addresses = []
-    regex_address = re.compile('^residents.txt:.+\t([0-9]+) (.+)$')
     for suspect_name in suspect_names:
-        match = regex_address.match(repo.git.grep('-w', suspect_name, '--', 'residents.txt'))
-        if not match:
+        if suspect_name not in residents:
             echo(f"Failed to find {suspect_name}'s address")
             return False
-        (number, street_name, ) = match.groups()
+        (number, street_name, ) = residents[suspect_name].split(' ', 1)
         addresses.append((suspect_name, street_name, int(number)))
 
     secho('Interviewing suspects', fg='magenta')
     lead = rot13('terra Ulhaqnv')
     for (suspect_name, street_name, number) in addresses:
         street_tag_name = street_name.lower().replace(' ', '_')
-        street_ref = f'street/{street_tag_name}~{number}'
-        (_, _, _, commit_msg) = regex_commit_log.match(repo.git.show('-s', street_ref)).groups()
-        if lead in commit_msg:
+        street_ref = f'refs/tags/street/{street_tag_name}~{number}'
+        house = reader.commit(street_ref)
+        if lead in house.message:
             echo('  Got a lead by interviewing a suspect')
             current_suspects.remove(suspect_name)
             continue
-        investigate_ref = repo.git.show(f'{street_ref}:investigate')
-        investigation = repo.git.show(investigate_ref)
+        investigate_ref = reader.text(f'{house.hexsha}:investigate')
+        investigation = reader.text(investigate_ref)
         if lead not in investigation:
             echo('  Suspect dropped due to lead')
             current_suspects.remove(suspect_name)
@@ -134,14 +127,53 @@ def verify_repository(repo):
         return False
 
     secho('Checking suspect', fg='magenta')
-    solution_hash = check_output(
-        f'echo "{suspect}" | git hash-object --stdin',
-        cwd=repo_root,
-        shell=True,
-        universal_newlines=True)
-    if solution_hash.strip('\n') != repo.git.show('solution'):
+    # Same as `echo "<suspect>" | git hash-object --stdin`.
+    solution_hash = blob_hash(f'{suspect}\n')
+    if solution_hash != reader.text('refs/tags/solution'):
         echo('Found the wrong suspect!')
         return False
 
     secho('Good!', fg='green')
     return True
+
+def _pickaxe(reader, branch, text):
+    """Find the commits which change the number of occurrences of `text` in any of the files.
+
+    Same as `git log -S<text>`.
+    """
+    occurrences = {None: 0, }
+    def _count(hexsha):
+        if hexsha not in occurrences:
+            occurrences[hexsha] = reader.text(hexsha).count(text)
+        return occurrences[hexsha]
+
+    commits = list(reader.history(branch))
+    trees = dict((commit.hexsha, commit.tree) for commit in commits)
+    for commit in commits:
+        parent_tree = trees[commit.parents[0]] if commit.parents else None
+        if any(_count(blob) != _count(parent_blob)
+                for (blob, parent_blob) in _changed_blobs(reader, commit.tree, parent_tree)):
+            yield commit
+
+def _changed_blobs(reader, tree, parent_tree):
+    """Like `git diff-tree -r`, only reads the sub-trees which changed.
+
+    Generates the IDs of each changed file before and after the change (`None` if the file was
+    added or deleted).
+    """
+    entries = reader.tree(tree) if tree else {}
+    parent_entries = reader.tree(parent_tree) if parent_tree else {}
+    for name in set(entries) | set(parent_entries):
+        (mode, hexsha) = entries.get(name, (None, None))
+        (parent_mode, parent_hexsha) = parent_entries.get(name, (None, None))
+        if hexsha == parent_hexsha:
+            continue
+        if TREE_MODE in (mode, parent_mode):
+            yield from _changed_blobs(reader,
+                hexsha if TREE_MODE == mode else None,
+                parent_hexsha if TREE_MODE == parent_mode else None)
+        blobs = (
+            hexsha if mode not in (None, TREE_MODE) else None,
+            parent_hexsha if parent_mode not in (None, TREE_MODE) else None)
+        if any(blobs):
+            yield blobs
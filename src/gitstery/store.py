@@ -0,0 +1,91 @@
+from pathlib import Path
+from git import Repo
+from .defines import SHARED_STORE_PACK_LIMIT
+from .git_utils import git_stdin
+
+class SharedStore():
+    """An object store shared by many mysteries, linked to each of them as an alternate.
+
+    Mysteries drawn from different seeds never share a commit or a tree, but many of their blobs are
+    the same: the fixed files and the texts taken from the book. Those are kept in the store (a bare
+    repository without any references) and each mystery only keeps the objects the store doesn't
+    have. Seed-specific blobs (such as the residents file) end up in the store as well, they're a
+    small part of it.
+
+    The store's objects aren't referenced by anything in it, so it's never garbage collected.
+    """
+    def __init__(self, path):
+        self.__path = Path(path).resolve()
+        self.__repo = Repo(self.__path)
+
+    @classmethod
+    def create(cls, path):
+        """Open the store at the given path, creating it if it doesn't exist yet."""
+        repo = Repo.init(path, mkdir=True, bare=True)
+        with repo.config_writer() as config:
+            config.set_value('gc', 'auto', 0)
+            config.set_value('gc', 'pruneExpire', 'never')
+        return cls(path)
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def objects_dir(self):
+        return self.__path / 'objects'
+
+    def link(self, repo):
+        """Link a repository to the store, before anything is written into it.
+
+        Objects already in the store aren't written again by the fast-import backend, those written
+        anyway are dropped from the repository once it's shared.
+        """
+        alternates = Path(repo.git_dir) / 'objects' / 'info' / 'alternates'
+        alternates.parent.mkdir(parents=True, exist_ok=True)
+        alternates.write_text(f'{self.objects_dir}\n')
+
+    def share(self, repo):
+        """Move a linked repository's blobs into the store, returning how many were added to it."""
+        objects = repo.git.rev_list('--objects', '--all', '--no-object-names',
+            '--filter=object:type=blob').split()
+        # The commits are listed regardless of the filter.
+        blobs = [line.split()[1]
+            for line in git_stdin(repo, ['cat-file', '--batch-check=%(objecttype) %(objectname)'],
+                objects).splitlines()
+            if line.startswith('blob ')]
+        missing = [line.split()[0]
+            for line in git_stdin(self.__repo, ['cat-file', '--batch-check'], blobs).splitlines()
+            if line.endswith(' missing')]
+        if missing:
+            git_stdin(repo, ['pack-objects', '-q', str(self.objects_dir / 'pack' / 'pack')],
+                missing)
+
+        # Only the objects which aren't in the store are kept in the repository's own pack.
+        repo.git.repack('-a', '-d', '-l', '-q')
+        return len(missing)
+
+    def repack(self, limit=SHARED_STORE_PACK_LIMIT):
+        """Repack the store into a single pack once it has more than `limit` packs.
+
+        Every repository shared adds a pack, and every pack makes looking objects up slower. This
+        mustn't run while repositories are being shared.
+        """
+        packs = list((self.objects_dir / 'pack').glob('*.pack'))
+        if limit < len(packs):
+            # None of the store's objects are reachable from its (non-existent) references, and
+            # without any there's nothing for a bitmap to index.
+            self.__repo.git.repack('-a', '-d', '-q', '--keep-unreachable',
+                '--no-write-bitmap-index')
+
+def detach(repo):
+    """Copy all of the objects a repository borrows from its alternates into it, and unlink them.
+
+    Returns whether the repository had any alternates to begin with.
+    """
+    alternates = Path(repo.git_dir) / 'objects' / 'info' / 'alternates'
+    if not alternates.is_file():
+        return False
+    repo.git.repack('-a', '-d', '-q')
+    alternates.unlink()
+    return True
@@ -0,0 +1,76 @@
+from array import array
+from .fillers import data_names
+
+class Town():
+    """Git Town's residents, kept in columns rather than as a `Person` for each of them.
+
+    Every resident is a street ID, a house number and a name ID, ordered by their addresses. Names
+    are identified by their index among all (given name, surname) pairs, the town's notable people
+    (whose names aren't made of those) are numbered after them. Only notable people are commit
+    authors, anyone else is only ever a name and an address.
+
+    Iterating over the town goes over its streets' names, in order.
+    """
+    def __init__(self, street_names, notable_people):
+        self.__street_names = tuple(street_names)
+        self.__streets = {}
+        self.__given_names = data_names('given-names.txt')
+        self.__surnames = data_names('surnames.txt')
+        self.__notable_people = tuple(notable_people)
+        self.__notable_residents = {}
+        self.__street_ids = array('B')
+        self.__numbers = array('L')
+        self.__name_ids = array('L')
+
+    def __iter__(self):
+        return iter(self.__street_names)
+
+    def __len__(self):
+        return len(self.__name_ids)
+
+    @property
+    def names_count(self):
+        """The number of names random residents are named by."""
+        return len(self.__given_names) * len(self.__surnames)
+
+    def add_street(self, street_name, length, notable_residents, residents):
+        """Add a street's houses, with the notable people living in some of them by house number.
+
+        The rest of the houses are taken by the next of `residents`, name IDs (as generated by
+        `random_people`).
+        """
+        street_id = self.__street_names.index(street_name)
+        start = len(self)
+        for number in range(1, length + 1):
+            person = notable_residents.get(number)
+            if person is None:
+                name_id = next(residents)
+            else:
+                name_id = self.names_count + self.__notable_people.index(person)
+                self.__notable_residents[person] = len(self)
+            self.__street_ids.append(street_id)
+            self.__numbers.append(number)
+            self.__name_ids.append(name_id)
+        self.__streets[street_name] = range(start, len(self))
+
+    def street(self, street_name):
+        """The residents of a street, ordered by their house numbers."""
+        return self.__streets[street_name]
+
+    def find(self, person):
+        """Find a notable person's resident, or `None` if they don't live in town."""
+        return self.__notable_residents.get(person)
+
+    def name(self, resident):
+        name_id = self.__name_ids[resident]
+        if self.names_count <= name_id:
+            return self.__notable_people[name_id - self.names_count].name
+        (given_name, surname) = divmod(name_id, len(self.__surnames))
+        return f'{self.__given_names[given_name]} {self.__surnames[surname]}'
+
+    def address(self, resident):
+        return (self.__street_names[self.__street_ids[resident]], self.__numbers[resident])
+
+    def sorted_by_name(self):
+        """All of the residents, sorted by their names."""
+        return sorted(range(len(self)), key=self.name)
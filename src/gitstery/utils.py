@@ -1,9 +1,67 @@
 from codecs import encode
+from functools import lru_cache
 from textwrap import wrap
-from .defines import COMMIT_MSG_WIDTH
+from queue import Queue, Empty
+from threading import Thread, Event
+from .defines import COMMIT_MSG_WIDTH, PIPELINE_DEPTH
+
+class WrappedText(str):
+    """Text whose paragraphs are already wrapped to the commit message width."""
 
 def wrap_paragraphs(text, width=COMMIT_MSG_WIDTH):
+    if isinstance(text, WrappedText) and COMMIT_MSG_WIDTH == width:
+        return text
     return '\n\n'.join('\n'.join(wrap(paragraph, width)) for paragraph in text.split('\n\n'))
 
 def rot13(text):
     return encode(text, 'rot_13')
+
+@lru_cache(maxsize=None)
+def inflect_engine():
+    # Importing `inflect` (and building its engine) takes longer than everything else the CLI does,
+    # so it's only done once and only by the commands that need it.
+    from inflect import engine
+    return engine()
+
+def pipelined(items, depth=PIPELINE_DEPTH):
+    """Generate the items of an iterable, which is consumed by a background thread ahead of time.
+
+    This lets the items be prepared while the previous ones are being written. The thread stays at
+    most `depth` items ahead, and anything it raises is raised again when its item is reached. The
+    items are only ever prepared by the thread, in order, so those drawing random numbers draw the
+    same ones as long as nothing else draws any until they're all consumed.
+    """
+    queue = Queue(depth)
+    stop = Event()
+
+    def _produce():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                queue.put((True, item))
+        except BaseException as err:
+            queue.put((False, err))
+        else:
+            queue.put((False, None))
+
+    producer = Thread(target=_produce, name='pipeline', daemon=True)
+    producer.start()
+    try:
+        while True:
+            (is_item, item) = queue.get()
+            if is_item:
+                yield item
+            elif item is None:
+                break
+            else:
+                raise item
+    finally:
+        # The consumer may stop early, the producer is then let go of and waited for.
+        stop.set()
+        while producer.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
+        producer.join()
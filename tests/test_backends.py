@@ -0,0 +1,26 @@
+import sys
+import json
+from subprocess import run, check_output
+
+# Any seed will do, the mystery only has to be the same whichever way it's generated.
+SEED = '0123456789abcdef0123'
+
+def gitstery(*args):
+    return run([sys.executable, '-m', 'gitstery', *args],
+        capture_output=True, universal_newlines=True, check=True)
+
+def generated_refs(repo_dir, *args):
+    gitstery('generate', '--force', '--seed', SEED, *args, str(repo_dir))
+    lines = check_output(['git', 'for-each-ref', '--format=%(refname) %(objectname)'],
+        cwd=repo_dir, universal_newlines=True)
+    return dict(line.split() for line in lines.splitlines())
+
+def test_backends_write_the_same_refs(tmp_path):
+    index_refs = generated_refs(tmp_path / 'index', '--backend', 'index')
+    assert generated_refs(tmp_path / 'fast-import', '--backend', 'fast-import') == index_refs
+    # The streets' commits are written by workers, into packs of their own.
+    assert generated_refs(tmp_path / 'jobs', '--backend', 'fast-import', '--jobs', '2') == index_refs
+
+    manifest = tmp_path / 'manifest.json'
+    gitstery('generate', '--seed', SEED, '--dry-run', '--manifest', str(manifest))
+    assert json.loads(manifest.read_text())['refs'] == index_refs
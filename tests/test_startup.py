@@ -0,0 +1,31 @@
+import sys
+from subprocess import run
+
+# Importing any of these takes longer than everything else the CLI does on startup, so they're only
+# imported by the commands using them.
+HEAVY_MODULES = ('git', 'inflect', 'gitstery.mystery', )
+# Importing the CLI takes ~50ms, the budget leaves room for slower machines.
+IMPORT_TIME_BUDGET_US = 200_000
+
+def import_times():
+    """Import the CLI in a fresh interpreter, mapping each module imported to its cumulative time.
+
+    `-X importtime` writes "import time: <self us> | <cumulative us> | <module>" lines to the standard
+    error, with nested imports indented.
+    """
+    process = run([sys.executable, '-X', 'importtime', '-c', 'import gitstery.cli'],
+        capture_output=True, universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        (_, cumulative, module) = line.split('|')
+        if cumulative.strip().isdigit():
+            times[module.strip()] = int(cumulative)
+    return times
+
+def test_heavy_modules_not_imported():
+    times = import_times()
+    assert [module for module in HEAVY_MODULES if module in times] == []
+
+def test_import_time_budget():
+    times = import_times()
+    assert times['gitstery.cli'] < IMPORT_TIME_BUDGET_US